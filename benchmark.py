@@ -0,0 +1,265 @@
+import fitz
+import openpyxl
+
+import os
+import sys
+import ast
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import logging
+
+import collator
+import bulk_collator
+from mark_matrix import MarkMatrix
+from mark_parser import MarkParser
+from profiling import Profiler
+
+
+FEEDBACK_TYPES = ["Text", "Highlight", "StrikeOut", "Caret", "Underline"]
+
+# modules whose import time is measured, and dependencies which they should not import at startup
+STARTUP_MODULES = ["collator", "bulk_collator"]
+
+HEAVY_MODULES = ["fitz", "pymupdf", "openpyxl", "numpy"]
+
+STAGES = ["extraction", "aggregation", "pdf_write", "collation", "generate_spreadsheet", "generate_combined_spreadsheet", "use_combined_spreadsheet"]
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--submissions", type=int, default=10, help="number of submissions in the synthetic cohort")
+    parser.add_argument("--markers", type=int, default=3, help="number of markers per submission")
+    parser.add_argument("--pages", type=int, default=20, help="number of pages per submission")
+    parser.add_argument("--questions", type=int, default=10, help="number of questions per submission")
+    parser.add_argument("--mark-density", type=float, default=1.0, help="probability of a marker leaving a mark comment for each question")
+    parser.add_argument("--feedback-density", type=float, default=2.0, help="average number of feedback annotations per page per marker")
+    parser.add_argument("--seed", type=int, default=0, help="seed used to generate the synthetic cohort")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times each stage is timed")
+    parser.add_argument("--import-budget", type=float, default=0.1, help="seconds the collator scripts may take to import before a warning is logged")
+    parser.add_argument("--work-dir", type=str, default=None, help="directory to create the cohort directory in, the system temporary directory is used by default")
+    parser.add_argument("--keep", type=bool, default=False, action=argparse.BooleanOptionalAction, help="keep the generated cohort after benchmarking")
+    parser.add_argument("--output", type=str, default=None, help="file to write json results to, printed to stdout by default")
+    return parser.parse_args()
+
+
+def random_rect(rng: random.Random, page_rect) -> fitz.Rect:
+    x = rng.uniform(page_rect.x0 + 50, page_rect.x1 - 200)
+    y = rng.uniform(page_rect.y0 + 50, page_rect.y1 - 50)
+    return fitz.Rect(x, y, x + rng.uniform(40, 150), y + 12)
+
+
+def add_feedback(rng: random.Random, page, author: str):
+    feedback_type = rng.choice(FEEDBACK_TYPES)
+    rect = random_rect(rng, page.rect)
+    if feedback_type == "Text":
+        annotation = page.add_text_annot(rect.tl, "Feedback from {}".format(author))
+    elif feedback_type == "Highlight":
+        annotation = page.add_highlight_annot(rect)
+    elif feedback_type == "StrikeOut":
+        annotation = page.add_strikeout_annot(rect)
+    elif feedback_type == "Caret":
+        annotation = page.add_caret_annot(rect.tl)
+    else:
+        annotation = page.add_underline_annot(rect)
+    annotation.set_info(content="Feedback from {}".format(author), title=author)
+    annotation.update()
+
+
+def generate_cohort(args, root: str) -> list[str]:
+    rng = random.Random(args.seed)
+    directories: list[str] = []
+
+    for submission in range(args.submissions):
+        name = "submission_{:04d}".format(submission)
+        directory = os.path.join(root, name)
+        os.makedirs(directory, exist_ok=True)
+        directories.append(directory)
+
+        # base document with a little text on every page
+        base = fitz.open()
+        for page_number in range(args.pages):
+            page = base.new_page()
+            for line in range(10):
+                page.insert_text((72, 72 + 20 * line), "Submission {} page {} line {}".format(submission, page_number, line))
+        base_path = os.path.join(directory, name + ".pdf")
+        base.save(base_path)
+        base.close()
+
+        # marked copy from each marker with mark comments and feedback
+        for marker in range(args.markers):
+            author = "Marker {}".format(marker)
+            document = fitz.open(base_path)
+            for question in range(args.questions):
+                if rng.random() >= args.mark_density:
+                    continue
+                page = document[rng.randrange(args.pages)]
+                annotation = page.add_text_annot(random_rect(rng, page.rect).tl, "!# {} {}".format(question + 1, rng.randint(0, 20) / 2))
+                annotation.set_info(title=author)
+                annotation.update()
+            for page in document:
+                for _ in range(rng.randint(0, int(2 * args.feedback_density))):
+                    add_feedback(rng, page, author)
+            document.save(os.path.join(directory, "marker_{}.pdf".format(marker)))
+            document.close()
+
+    return directories
+
+
+def time_stage(repeat: int, function) -> dict:
+    timings: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {"seconds": min(timings), "mean_seconds": sum(timings) / len(timings), "runs": timings}
+
+
+def measure_import(repeat: int, module: str) -> dict:
+
+    # cumulative import time reported by the interpreter itself in a fresh process, excluding interpreter startup
+    timings: list[float] = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import sys, {}; print(sorted(set(sys.modules) & {}))".format(module, set(HEAVY_MODULES))], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        for line in process.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                timings.append(int(fields[1]) / 1e6)
+    return {"seconds": min(timings), "mean_seconds": sum(timings) / len(timings), "runs": timings, "heavy_modules": ast.literal_eval(process.stdout.strip())}
+
+
+def run_startup_benchmarks(args) -> dict:
+    startup: dict[str, dict] = {}
+    for module in STARTUP_MODULES:
+        logging.info("Timing import of {}.".format(module))
+        startup[module] = measure_import(args.repeat, module)
+        if startup[module]["seconds"] > args.import_budget:
+            logging.warning("Importing {} took {:.3f}s, over the budget of {:.3f}s.".format(module, startup[module]["seconds"], args.import_budget))
+        if startup[module]["heavy_modules"]:
+            logging.warning("Importing {} also imported {}.".format(module, ", ".join(startup[module]["heavy_modules"])))
+    return startup
+
+
+def run_benchmarks(args, directories: list[str]) -> dict:
+    collation_args = {directory: collator.get_arguments([directory, os.path.basename(directory) + ".pdf", "--no-cache"]) for directory in directories}
+    pdf_collections = {directory: sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.startswith("marker_")) for directory in directories}
+
+    parser = MarkParser("!#")
+
+    # records extracted once up front so later stages can be timed in isolation
+    extracted = {directory: [collator.extract_document(pdf, parser) for pdf in pdf_collections[directory]] for directory in directories}
+
+    def extraction():
+        for directory in directories:
+            for pdf in pdf_collections[directory]:
+                collator.extract_document(pdf, parser)
+
+    def aggregation():
+        for directory in directories:
+            matrix = MarkMatrix()
+            aliases: dict[str, str] = {}
+            sources: dict[tuple[str, str], str] = {}
+            for pdf, (document_marks, document_comments, _) in zip(pdf_collections[directory], extracted[directory]):
+                collator.aggregate_marks(collation_args[directory], matrix, aliases, sources, pdf, document_marks, document_comments)
+            matrix.means()
+
+    # everything the collator does once annotations are extracted, including deduplication and the template cache
+    def collate_extracted(directory: str) -> collator.CollationResult:
+        return collator.collate_extracted(collation_args[directory], pdf_collections[directory], extracted[directory], None, Profiler(enabled=False))
+
+    results = {directory: collate_extracted(directory) for directory in directories}
+
+    def pdf_write():
+        for directory in directories:
+            collate_extracted(directory)
+
+    def collation():
+        for directory in directories:
+            collator.collate_directory(collation_args[directory])
+
+    def generate_spreadsheet():
+        for directory in directories:
+            collator.generate_spreadsheet(collation_args[directory], results[directory])
+
+    bulk_args = bulk_collator.get_arguments(directories)
+
+    def generate_combined_spreadsheet():
+        bulk_collator.generate_combined_spreadsheet(bulk_args, directories, results)
+
+    def use_combined_spreadsheet():
+        bulk_collator.use_combined_spreadsheet(bulk_args, directories)
+
+    stages = {
+        "extraction": extraction,
+        "aggregation": aggregation,
+        "pdf_write": pdf_write,
+        "collation": collation,
+        "generate_spreadsheet": generate_spreadsheet,
+        "generate_combined_spreadsheet": generate_combined_spreadsheet,
+        "use_combined_spreadsheet": use_combined_spreadsheet,
+    }
+
+    timings: dict[str, dict] = {}
+    for stage in STAGES:
+        logging.info("Timing {}.".format(stage))
+        timings[stage] = time_stage(args.repeat, stages[stage])
+    return timings
+
+
+def main():
+
+    # set logging format
+    collator.setup_logging()
+
+    # extract agruments using argparse standard lib
+    args = get_arguments()
+
+    if args.submissions < 1 or args.markers < 1 or args.pages < 1 or args.repeat < 1:
+        logging.error("Submissions, markers, pages and repeat must be at least 1!")
+        exit(-1)
+
+    # the cohort is always generated in a new directory so only files the benchmark created are removed
+    if args.work_dir is not None:
+        os.makedirs(args.work_dir, exist_ok=True)
+    root = tempfile.mkdtemp(prefix="collator-benchmark-", dir=args.work_dir)
+    try:
+        logging.info("Generating {} submissions with {} markers and {} pages in \"{}\".".format(args.submissions, args.markers, args.pages, root))
+        start = time.perf_counter()
+        directories = generate_cohort(args, root)
+        generation_seconds = time.perf_counter() - start
+
+        stages = run_benchmarks(args, directories)
+        startup = run_startup_benchmarks(args)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("work_dir", "keep", "output")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pymupdf": fitz.VersionBind,
+            "openpyxl": openpyxl.__version__,
+        },
+        "generation_seconds": generation_seconds,
+        "startup": startup,
+        "stages": stages,
+    }
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        logging.info("Benchmark results saved to \"{}\"".format(args.output))
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,148 +1,597 @@
 
-from openpyxl import Workbook
-from openpyxl.styles import Font
-from openpyxl.utils import get_column_letter
-from openpyxl.chart import BarChart, Reference
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Font
-
 import os
-import subprocess
 import argparse
 import logging
+import concurrent.futures
+import concurrent.futures.process
+import collections
+import copy
+import glob
+import hashlib
+import itertools
+import json
+import time
+import pstats
+import shutil
+import tempfile
+import typing
+
+import collator
+import extraction_cache
+import manifest
+import marks_export
+import mark_parser
+from profiling import Profiler
+
+# openpyxl and numpy are slow to import so are only imported by the code paths which use them
+if typing.TYPE_CHECKING:
+    from mark_matrix import MarkMatrix
+
+
+STATE_VERSION = 6
 
+STATE_FILE = ".collation_state.json"
 
-def get_arguments():
+JOURNAL_FILE = ".collation_journal.jsonl"
+
+
+def get_arguments(argv: list[str] = None):
     parser = argparse.ArgumentParser()
-    parser.add_argument("directories", nargs='+', help="list of directories to collate together")
+    parser.add_argument("directories", nargs='*', help="list of directories to collate together")
+    parser.add_argument("--manifest", type=str, default=None, help="csv or json manifest of submissions to collate instead of directories")
+    parser.add_argument("--marks-export", type=str, default=None, help="file to export the marks of every submission to, as nested .json or one record per mark as .csv, .sqlite, .db or .parquet")
+    parser.add_argument("--override-marks", type=str, default=None, help=".csv, .sqlite, .db or .parquet marks file in the export format to override marks from collated pdfs")
     parser.add_argument("--generate-individual-spreadsheet", type=bool, default=False, action=argparse.BooleanOptionalAction, help="generate marks spreadsheet for individual collations")
     parser.add_argument("--use-individual-spreadsheet", type=bool, default=False, action=argparse.BooleanOptionalAction, help="use marks spreadsheet to override pdf marks for individual collations")
     parser.add_argument("--generate-combined-spreadsheet", type=bool, default=False, action=argparse.BooleanOptionalAction, help="generate spreadsheet of all collated marks")
     parser.add_argument("--use-combined-spreadsheet", type=bool, default=False, action=argparse.BooleanOptionalAction, help="use combined spreadsheet to override marks from collated pdfs")
-    return parser.parse_args()
+    parser.add_argument("--moderation-report", type=str, default=None, help="csv file to write questions ranked by marker disagreement to")
+    parser.add_argument("--marker-bias-report", type=str, default=None, help="csv file to write the bias of each marker across all submissions to")
+    parser.add_argument("--moderation-threshold", type=float, default=0.0, help="questions whose marks spread by more than this need moderation")
+    parser.add_argument("--comment-prefix-flag", type=str, default="!#", help="comment prefix which flags marks")
+    parser.add_argument("--mark-grammar", type=str, default="simple", help="format of marking comments, either one of {} or a regular expression with question and mark groups".format(", ".join(mark_parser.GRAMMARS)))
+    parser.add_argument("--spreadsheet-charts", type=bool, default=True, action=argparse.BooleanOptionalAction, help="include bar charts of marks in generated spreadsheets")
+    parser.add_argument("--deduplicate", type=bool, default=True, action=argparse.BooleanOptionalAction, help="drop feedback annotations identical to one already merged")
+    parser.add_argument("--coalesce-tolerance", type=float, default=0.0, help="also drop feedback annotations within this many points of one already merged")
+    parser.add_argument("--save-profile", type=str, default="default", choices=list(collator.SAVE_PROFILES) + ["incremental"], help="how the output pdfs are saved")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of submissions to collate in parallel")
+    parser.add_argument("--cache", type=bool, default=True, action=argparse.BooleanOptionalAction, help="cache extracted annotations of unchanged pdf files")
+    parser.add_argument("--cache-dir", type=str, default=extraction_cache.DEFAULT_CACHE_DIR, help="directory of extraction cache shared by all collations")
+    parser.add_argument("--cache-max-size", type=float, default=256.0, help="maximum size of extraction cache in megabytes")
+    parser.add_argument("--cache-max-age", type=float, default=30.0, help="maximum age of unused extraction cache entries in days")
+    parser.add_argument("--profile", type=bool, default=False, action=argparse.BooleanOptionalAction, help="report time and peak memory of each collation stage across all submissions")
+    parser.add_argument("--profile-json", type=str, default=None, help="file to write the stage profile to as json")
+    parser.add_argument("--cprofile", type=str, default=None, help="file to write combined cProfile statistics of all collations to")
+    parser.add_argument("--incremental", type=bool, default=False, action=argparse.BooleanOptionalAction, help="only recollate submissions whose inputs changed since the last build")
+    parser.add_argument("--resume", type=bool, default=False, action=argparse.BooleanOptionalAction, help="skip submissions already completed by an earlier or interrupted build")
+    parser.add_argument("--watch", type=bool, default=False, action=argparse.BooleanOptionalAction, help="keep running and recollate submissions as their inputs change")
+    parser.add_argument("--watch-interval", type=float, default=5.0, help="seconds between checks for changed inputs in watch mode")
+    return parser.parse_args(argv)
+
+
+def generate_combined_spreadsheet(args, names: list[str], results: dict[str, collator.CollationResult]):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+    from openpyxl.chart import BarChart, Reference
+    from openpyxl.styles import PatternFill, Font
+
+    # rows are streamed in order to a write only workbook so memory stays bounded for large cohorts
+    combined_wb = Workbook(write_only=True)
+    combined_ws = combined_wb.create_sheet()
 
+    font_standard = Font(name="Calibri", size=11, bold=False, italic=False, vertAlign=None, underline="none", strike=False, color="FF000000")
+    font_bold = Font(name="Calibri", size=11, bold=True, italic=False, vertAlign=None, underline="none", strike=False, color="FF000000")
+    fill_separator = PatternFill(fill_type="solid", start_color="00000000")
 
-def generate_combined_spreadsheet(args):
+    row_offset = 2
+    column_offset = 2
+    padding = [None] * (column_offset - 1)
 
-    directories: list[str] = args.directories
+    row_index = 1
 
-    combined_wb = Workbook()
-    combined_ws = combined_wb.active
+    def append_row(values: list):
+        nonlocal row_index
 
-    row_offset = 2
-    column_offset = 2
+        # row styles must be set before the row is written
+        combined_ws.row_dimensions[row_index].font = font_standard
+        combined_ws.append(values)
+        row_index += 1
 
-    directory_index = 0
-    for directory in directories:
-        individual_wb = load_workbook(os.path.join(directory, "extracted_marks.xlsx"))
-        individual_ws = individual_wb.active
-
-        marker_count = 0
-        while True:
-            if individual_ws.cell(2, marker_count + 3).value is None:
-                break
-            marker_count += 1
-
-        question_count = 0
-        while True:
-            if individual_ws.cell(question_count + 4, 2).value is None:
-                break
-            question_count += 1
-
-        combined_ws.cell(row_offset, column_offset).value = directory
-        for row in range(question_count + 2):
-            for column in range(marker_count + 1):
-                combined_ws.cell(row_offset + row + 1, column_offset + column).value = individual_ws.cell(row + 2, column + 2).value
-
-        combined_ws.cell(row_offset + question_count + 4, column_offset).value = "Total"
-        for column in range(marker_count):
-            combined_ws.cell(row_offset + question_count + 4, column_offset + column + 1).value = "=SUM({}{}:{}{})".format(get_column_letter(column_offset + column + 1), row_offset + 3, get_column_letter(column_offset + column + 1), row_offset + 2 + question_count)
-        combined_ws.cell(row_offset + question_count + 4, column_offset + marker_count + 2).value = "=SUM({}{}:{}{})".format(get_column_letter(column_offset + marker_count + 2), row_offset + 3, get_column_letter(column_offset + marker_count + 2), row_offset + 2 + question_count)
-        combined_ws.cell(row_offset + 2, column_offset + marker_count + 2).value = "Average"
+    append_row([])
+
+    for name in names:
+        result = results[name]
+        authors = result.matrix.authors
+        question_ids = result.matrix.question_ids
+        marks = result.matrix.to_rows()
+        marker_count = len(authors)
+        question_count = len(question_ids)
+
+        label = WriteOnlyCell(combined_ws, value=name)
+        label.font = font_bold
+        append_row(padding + [label])
+
+        # write aliases and author names
+        append_row(padding + ["Alias"] + [result.aliases[author] if author in result.aliases else None for author in authors])
+        append_row(padding + ["Authors"] + authors + [None, "Average"])
+
+        # write question ids, the individual marks from markers and formulae to average the marks of each question
         for row in range(question_count):
-            combined_ws.cell(row_offset + row + 3, column_offset + marker_count + 2).value = "=AVERAGE({}{}:{}{})".format(get_column_letter(column_offset + 1), row_offset + row + 3, get_column_letter(column_offset + marker_count), row_offset + row + 3)
+            average = "=AVERAGE({}{}:{}{})".format(get_column_letter(column_offset + 1), row_offset + row + 3, get_column_letter(column_offset + marker_count), row_offset + row + 3)
+            append_row(padding + ["Q: {}".format(question_ids[row])] + marks[row] + [None, average])
+        append_row([])
 
-        # create bar chart for marking data visualisation
-        chart = BarChart()
-        chart.type = "col"
-        chart.style = 10
-        chart.y_axis.title = "Mark Given"
-        chart.x_axis.title = "Question ID"
-        data = Reference(combined_ws, min_col=column_offset+1, min_row=row_offset+2, max_row=row_offset+question_count+2, max_col=column_offset+marker_count)
-        cats = Reference(combined_ws, min_col=column_offset, min_row=row_offset+3, max_row=row_offset+question_count+2)
-        chart.add_data(data, titles_from_data=True)
-        chart.set_categories(cats)
-        chart.height = 0.55 * (question_count + 5)
-        chart.width = 3 * (question_count)
-        combined_ws.add_chart(chart, "{}{}".format(get_column_letter(column_offset + marker_count + 4), row_offset))
-
-        for column in range(column_offset, column_offset + marker_count + 3):
-            combined_ws.cell(row_offset + question_count + 6, column).fill = PatternFill(fill_type="solid", start_color="00000000")
+        totals = ["=SUM({}{}:{}{})".format(get_column_letter(column_offset + column + 1), row_offset + 3, get_column_letter(column_offset + column + 1), row_offset + 2 + question_count) for column in range(marker_count)]
+        append_row(padding + ["Total"] + totals + [None, "=SUM({}{}:{}{})".format(get_column_letter(column_offset + marker_count + 2), row_offset + 3, get_column_letter(column_offset + marker_count + 2), row_offset + 2 + question_count)])
+        append_row([])
 
+        # create bar chart for marking data visualisation
+        if args.spreadsheet_charts:
+            chart = BarChart()
+            chart.type = "col"
+            chart.style = 10
+            chart.y_axis.title = "Mark Given"
+            chart.x_axis.title = "Question ID"
+            data = Reference(combined_ws, min_col=column_offset+1, min_row=row_offset+2, max_row=row_offset+question_count+2, max_col=column_offset+marker_count)
+            cats = Reference(combined_ws, min_col=column_offset, min_row=row_offset+3, max_row=row_offset+question_count+2)
+            chart.add_data(data, titles_from_data=True)
+            chart.set_categories(cats)
+            chart.height = 0.55 * (question_count + 5)
+            chart.width = 3 * (question_count)
+            combined_ws.add_chart(chart, "{}{}".format(get_column_letter(column_offset + marker_count + 4), row_offset))
+
+        # write separator between submissions
         combined_ws.row_dimensions[row_offset + question_count + 6].height = 7.5
+        separator = []
+        for _ in range(marker_count + 3):
+            cell = WriteOnlyCell(combined_ws)
+            cell.fill = fill_separator
+            separator.append(cell)
+        append_row(padding + separator)
+        append_row([])
 
-        directory_index += 1
         row_offset += question_count + 8
 
-    font_standard = Font(name="Calibri", size=11, bold=False, italic=False, vertAlign=None, underline="none", strike=False, color="FF000000")
-    font_bold = Font(name="Calibri", size=11, bold=True, italic=False, vertAlign=None, underline="none", strike=False, color="FF000000")
+    save_directory = get_save_directory(args)
+    with collator.atomic_output(os.path.join(save_directory, "combined_extracted_marks.xlsx")) as temp_path:
+        combined_wb.save(filename=temp_path)
 
-    for row in range(row_offset):
-        combined_ws.row_dimensions[row].font = font_standard
 
-    row_offset = 2
+def use_combined_spreadsheet(args, names: list[str]) -> dict[str, "MarkMatrix"]:
+    from openpyxl import load_workbook
+    from mark_matrix import MarkMatrix
+
+    save_directory = get_save_directory(args)
+    combined_wb = load_workbook(os.path.join(save_directory, "combined_extracted_marks.xlsx"), read_only=True)
+    combined_ws = combined_wb.active
+
     column_offset = 2
 
-    for directory in directories:
-        combined_ws.cell(row_offset, column_offset).font = font_bold
-        row_offset += question_count + 8
+    # index marks of each block by submission, question and author in a single pass over the rows
+    blocks: list[tuple[str, "MarkMatrix"]] = []
+    block = None
+    authors = None
+    previous_label = None
+    for row in combined_ws.iter_rows(values_only=True):
+        label = row[column_offset - 1] if len(row) >= column_offset else None
+        values = row[column_offset:]
 
-    save_directory = os.path.abspath(os.path.join(directories[0], os.pardir))
-    combined_wb.save(filename=os.path.join(save_directory, "combined_extracted_marks.xlsx"))
+        if label == "Alias" and previous_label is not None:
+            block = MarkMatrix()
+            authors = None
+            blocks.append((str(previous_label), block))
+        elif label == "Authors" and block is not None:
+            authors = list(itertools.takewhile(lambda value: value is not None, values))
+        elif isinstance(label, str) and label.startswith("Q: ") and authors is not None:
+            for column in range(len(authors)):
+                block.add_mark(label.removeprefix("Q: "), authors[column], values[column] if column < len(values) else None)
+        else:
+            block = None
+            authors = None
 
+        previous_label = label
 
-def use_combined_spreadsheet(args):
+    combined_wb.close()
 
-    directories: list[str] = args.directories
+    return match_spreadsheet_blocks(names, blocks)
 
-    save_directory = os.path.abspath(os.path.join(directories[0], os.pardir))
-    combined_wb = load_workbook(os.path.join(save_directory, "combined_extracted_marks.xlsx"))
-    combined_ws = combined_wb.active
 
-    row_offset = 2
-    column_offset = 2
+def spreadsheet_label_key(label: str) -> str:
 
-    directory_index = 0
-    for directory in directories:
-        individual_wb = load_workbook(os.path.join(directory, "extracted_marks.xlsx"))
-        individual_ws = individual_wb.active
+    # spreadsheets may have been generated on another platform, so either path separator is accepted
+    return os.path.normpath(label.replace("\\", "/")).replace("\\", "/")
 
-        marker_count = 0
-        while True:
-            if combined_ws.cell(row_offset + 2, column_offset + marker_count + 1).value is None:
-                break
-            marker_count += 1
 
-        question_count = 0
-        while True:
-            if combined_ws.cell(row_offset + question_count + 3, column_offset).value is None:
-                break
-            question_count += 1
+def match_spreadsheet_blocks(names: list[str], blocks: list[tuple[str, "MarkMatrix"]]) -> dict[str, "MarkMatrix"]:
 
-        for row in range(question_count):
-            for col in range(marker_count):
-                individual_ws.cell(4 + row, 3 + col).value = combined_ws.cell(row + 3 + row_offset, col + column_offset + 1).value
+    # match blocks to the submissions being collated by label, then by directory name
+    labelled = {spreadsheet_label_key(label): block for label, block in blocks}
+    if all(spreadsheet_label_key(name) in labelled for name in names):
+        return {name: labelled[spreadsheet_label_key(name)] for name in names}
 
-        individual_wb.save(filename=os.path.join(directory, "extracted_marks.xlsx"))
+    basenames = [os.path.basename(spreadsheet_label_key(label)) for label, _ in blocks]
+    if len(basenames) == len(set(basenames)) and len(names) == len(set(os.path.basename(spreadsheet_label_key(name)) for name in names)):
+        by_basename = dict(zip(basenames, (block for _, block in blocks)))
+        if all(os.path.basename(spreadsheet_label_key(name)) in by_basename for name in names):
+            return {name: by_basename[os.path.basename(spreadsheet_label_key(name))] for name in names}
 
-        directory_index += 1
-        row_offset += question_count + 8
+    # otherwise blocks are taken in the order the submissions were given, as the spreadsheet was generated
+    if len(blocks) == len(names):
+        logging.warning("Combined marks spreadsheet labels do not match the submissions, using its blocks in order.")
+        return {name: block for name, (_, block) in zip(names, blocks)}
+
+    for name in names:
+        if spreadsheet_label_key(name) not in labelled:
+            raise collator.CollationError("Combined marks spreadsheet has no marks for \"{}\"!".format(name))
+
+
+def get_collation_args(args):
+
+    # options shared by every submission are parsed once, the input directory and file are placeholders
+    collator_argv = [os.curdir, "base.pdf"]
+    collator_argv.extend(["--comment-prefix-flag", args.comment_prefix_flag, "--mark-grammar", args.mark_grammar])
+
+    if args.generate_individual_spreadsheet:
+        collator_argv.append("--generate-spreadsheet")
+
+    if args.use_individual_spreadsheet:
+        collator_argv.append("--use-spreadsheet")
+
+    if not args.spreadsheet_charts:
+        collator_argv.append("--no-spreadsheet-charts")
+
+    collator_argv.extend(["--deduplicate" if args.deduplicate else "--no-deduplicate", "--coalesce-tolerance", str(args.coalesce_tolerance)])
+
+    collator_argv.extend(["--save-profile", args.save_profile])
+
+    # share the one extraction cache between all submissions
+    collator_argv.extend(["--cache" if args.cache else "--no-cache", "--cache-dir", args.cache_dir])
+
+    return collator.get_arguments(collator_argv)
+
+
+def get_submission_args(shared_args, submission: manifest.Submission):
+    submission_args = copy.copy(shared_args)
+    submission_args.input_dir = os.path.dirname(submission.base)
+    submission_args.input_file = os.path.basename(submission.base)
+    submission_args.output_file = submission.output
+    submission_args.marked_files = list(submission.markers)
+    submission_args.spreadsheet_file = submission.spreadsheet
+
+    # manifests may place outputs in directories which do not exist yet
+    os.makedirs(os.path.dirname(submission.output), exist_ok=True)
+    os.makedirs(os.path.dirname(submission.spreadsheet), exist_ok=True)
+    return submission_args
+
+
+def get_submissions(args) -> list[manifest.Submission]:
+    if args.manifest is not None:
+        submissions = manifest.load_manifest(args.manifest)
+    else:
+        submissions = [manifest.directory_submission(directory) for directory in args.directories]
+    manifest.validate_submissions(submissions)
+    return submissions
+
+
+def hash_input(path: str, file_hashes: dict) -> str:
+
+    # files are only read again when their size or modification time changed since they were last hashed
+    path = os.path.abspath(path)
+    try:
+        status = os.stat(path)
+    except FileNotFoundError:
+
+        # missing inputs fail their collation, which is only retried while watching once they appear
+        return "missing"
+    cached = file_hashes.get(path)
+    if cached is not None and cached[0] == status.st_size and cached[1] == status.st_mtime_ns:
+        return cached[2]
+    digest = extraction_cache.hash_file(path)
+    file_hashes[path] = [status.st_size, status.st_mtime_ns, digest]
+    return digest
+
+
+def fingerprint_submission(args, collation_args, file_hashes: dict, overriding_marks: "MarkMatrix" = None) -> str:
+    digest = hashlib.sha256()
+
+    # options which change the produced output
+    digest.update(repr(sorted((key, value) for key, value in vars(collation_args).items() if not key.startswith("cache"))).encode())
+
+    # base and marked pdf files
+    for pdf in [os.path.join(collation_args.input_dir, collation_args.input_file)] + collation_args.marked_files:
+        digest.update(os.path.basename(pdf).encode())
+        digest.update(hash_input(pdf, file_hashes).encode())
+
+    # overriding marks, only the submission's own block of the combined spreadsheet affects its output
+    if overriding_marks is not None:
+        digest.update(json.dumps(overriding_marks.to_dict(), sort_keys=True).encode())
+    elif args.use_individual_spreadsheet:
+        digest.update(hash_input(collation_args.spreadsheet_file, file_hashes).encode())
+
+    return digest.hexdigest()
+
+
+def is_up_to_date(args, collation_args, state_entry, fingerprint) -> bool:
+    if fingerprint is None or state_entry is None or state_entry["fingerprint"] != fingerprint:
+        return False
+
+    # failed collations are retried on every build, except while watching where they wait for their inputs to change
+    if state_entry["failed"]:
+        return args.watch
+    if state_entry["result"] is None:
+        return False
+
+    # outputs must still exist to be reused
+    if not os.path.exists(collation_args.output_file):
+        return False
+    if collation_args.generate_spreadsheet and not os.path.exists(collation_args.spreadsheet_file):
+        return False
+
+    return True
+
+
+def load_state(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"version": STATE_VERSION, "submissions": {}, "files": {}}
+
+    try:
+        with open(path, "r") as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        logging.warning("Ignoring unreadable build state \"{}\".".format(path))
+        return {"version": STATE_VERSION, "submissions": {}, "files": {}}
+
+    if state.get("version") != STATE_VERSION:
+        return {"version": STATE_VERSION, "submissions": {}, "files": {}}
+    return state
+
+
+def save_state(path: str, state: dict):
+    with collator.atomic_output(path) as temp_path, open(temp_path, "w") as file:
+        json.dump(state, file, indent=2)
+
+
+def replay_journal(path: str, state: dict):
+    if not os.path.exists(path):
+        return
+
+    # entries are applied in order over the last saved state, a line torn by a crash mid write is ignored
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning("Ignoring incomplete entry in build journal \"{}\".".format(path))
+                continue
+            if record.get("version") == STATE_VERSION:
+                state["submissions"][record["output"]] = record["entry"]
+
+
+def append_journal(file, output: str, entry: dict):
+    file.write(json.dumps({"version": STATE_VERSION, "output": output, "entry": entry}) + "\n")
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def get_save_directory(args) -> str:
+    if args.manifest is not None:
+        return os.path.dirname(os.path.abspath(args.manifest))
+    return os.path.abspath(os.path.join(args.directories[0], os.pardir))
+
+
+def get_overriding_source(args) -> str:
+    if args.use_combined_spreadsheet:
+        return os.path.join(get_save_directory(args), "combined_extracted_marks.xlsx")
+    if args.override_marks is not None:
+        return os.path.abspath(args.override_marks)
+    return None
+
+
+def collate_submissions(args, collation_args: dict, overriding_marks: dict, record=None) -> tuple[dict, list[str]]:
+    names = list(collation_args)
+
+    # collate submissions on a process pool, failures are reported per submission rather than aborting the batch
+    results: dict[str, collator.CollationResult] = {}
+    failed_submissions: list[str] = []
+    malformed_marks = 0
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=collator.setup_logging)
+    try:
+
+        # only a few submissions per worker are queued at once so large manifests do not pile up results in memory
+        queued = collections.deque(names)
+        futures = {}
+        while queued or futures:
+            while queued and len(futures) < 2 * args.jobs:
+                name = queued[0]
+                try:
+                    futures[executor.submit(collator.collate_directory, collation_args[name], overriding_marks.get(name), get_overriding_source(args), args.override_marks is not None)] = name
+                except concurrent.futures.process.BrokenProcessPool:
+                    break
+                queued.popleft()
+                logging.info("Collating {}.".format(name))
+
+            # a worker which died, such as from a crash reading a corrupt pdf, fails the submissions it shared the pool with,
+            # the remaining submissions are collated on a new pool
+            if not futures:
+                logging.error("Worker process terminated abruptly, restarting the pool for the remaining {} submissions.".format(len(queued)))
+                executor.shutdown(wait=False)
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=collator.setup_logging)
+                continue
+
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    results[name] = future.result()
+                    logging.info("Collation of \"{}\" succeeded.".format(name))
+                except Exception as error:
+                    logging.error("Collation of \"{}\" failed: {}".format(name, error))
+                    failed_submissions.append(name)
+                    if isinstance(error, collator.MarkParseError):
+                        malformed_marks += len(error.errors)
+                if record is not None:
+                    record(name, results.get(name))
+    finally:
+        executor.shutdown()
+
+    logging.info("Collated {} of {} submissions.".format(len(names) - len(failed_submissions), len(names)))
+
+    for name in sorted(failed_submissions, key=names.index):
+        logging.error("Failed: \"{}\"".format(name))
+
+    if malformed_marks > 0:
+        logging.error("Found {} malformed or duplicate marking comments, all are listed above.".format(malformed_marks))
+
+    return results, failed_submissions
+
+
+def build(args, profiler: Profiler) -> list[str]:
+
+    submissions = get_submissions(args)
+    names = [submission.name for submission in submissions]
+    save_directory = get_save_directory(args)
+
+    if args.use_combined_spreadsheet:
+        if not os.path.exists(os.path.join(save_directory, "combined_extracted_marks.xlsx")):
+            raise collator.CollationError("Combined marks spreadsheet does not exist in \"{}\"!".format(save_directory))
+
+    overriding_marks = {}
+    if args.use_combined_spreadsheet:
+        logging.info("Using combined spreadsheet to override pdf marks.")
+        with profiler.stage("use_combined_spreadsheet"):
+            overriding_marks = use_combined_spreadsheet(args, names)
+    elif args.override_marks is not None:
+        logging.info("Using \"{}\" to override pdf marks.".format(args.override_marks))
+        with profiler.stage("read_override_marks"):
+            overriding_marks = marks_export.read_overrides(args.override_marks, names)
+
+    shared_args = get_collation_args(args)
+    collation_args = {submission.name: get_submission_args(shared_args, submission) for submission in submissions}
+
+    # every build records what each submission was built from, including submissions completed by an interrupted build
+    state_path = os.path.join(save_directory, STATE_FILE)
+    journal_path = os.path.join(save_directory, JOURNAL_FILE)
+    state = load_state(state_path)
+    replay_journal(journal_path, state)
+    previous_hashes = copy.deepcopy(state["files"])
+
+    # every build fingerprints its inputs so a later --resume can skip what it completed, unreadable inputs are reported by their collation
+    fingerprints: dict[str, str] = {}
+    with profiler.stage("fingerprint_submissions"):
+        for name in names:
+            try:
+                fingerprints[name] = fingerprint_submission(args, collation_args[name], state["files"], overriding_marks.get(name))
+            except OSError as error:
+                logging.debug("Unable to fingerprint \"{}\": {}".format(name, error))
+                fingerprints[name] = None
+
+    # skip submissions whose inputs are unchanged since they were last built
+    if args.incremental:
+        outdated = [name for name in names if not is_up_to_date(args, collation_args[name], state["submissions"].get(collation_args[name].output_file), fingerprints[name])]
+        if not outdated and (not args.generate_combined_spreadsheet or os.path.exists(os.path.join(save_directory, "combined_extracted_marks.xlsx"))):
+            # files touched without being changed are recorded so they are not hashed again on the next check
+            if state["files"] != previous_hashes:
+                save_state(state_path, state)
+            if args.watch:
+                logging.debug("All submissions are up to date.")
+            else:
+                logging.info("All submissions are up to date.")
+            return []
+        logging.info("{} of {} submissions changed since last build.".format(len(outdated), len(names)))
+        collation_args = {name: collation_args[name] for name in outdated}
+
+    # each collation writes its own cProfile statistics which are combined once all have finished
+    cprofile_directory = tempfile.mkdtemp(prefix="collator-cprofile-") if args.cprofile else None
+    for index, name in enumerate(collation_args):
+        collation_args[name].profile = args.profile
+        if cprofile_directory is not None:
+            collation_args[name].cprofile = os.path.join(cprofile_directory, "{}.prof".format(index))
+
+    # each finished collation is journalled straight away so an interrupted build can be resumed
+    def record(name: str, result: collator.CollationResult):
+        entry = {
+            "submission": name,
+            "fingerprint": fingerprints.get(name),
+            "failed": result is None,
+            "result": result.to_dict() if result is not None else None,
+        }
+        state["submissions"][collation_args[name].output_file] = entry
+        append_journal(journal, collation_args[name].output_file, entry)
+
+    with profiler.stage("collate_submissions"), open(journal_path, "a") as journal:
+        results, failed_submissions = collate_submissions(args, collation_args, overriding_marks, record) if collation_args else ({}, [])
+
+    # fold the journal into the build state now that the batch has finished
+    save_state(state_path, state)
+    os.remove(journal_path)
+
+    for name, result in results.items():
+        profiler.merge(result.profile)
+        if result.profile is not None:
+            stage = result.profile.stages["collate_directory"]
+            profiler.record_file(name, "collate_directory", stage["seconds"], stage["peak_rss_mb"], stage["rss_growth_mb"])
+
+    if cprofile_directory is not None:
+        cprofile_files = glob.glob(os.path.join(cprofile_directory, "*.prof"))
+        if cprofile_files:
+            pstats.Stats(*cprofile_files).dump_stats(args.cprofile)
+            logging.info("cProfile statistics saved to \"{}\"".format(args.cprofile))
+        shutil.rmtree(cprofile_directory, ignore_errors=True)
+
+    # evict once for the whole batch rather than after every submission
+    collator.evict_cache(args)
+
+    # unchanged submissions reuse the marks recorded when they were last built
+    if args.incremental:
+        for submission in submissions:
+            if submission.name not in results and submission.name not in failed_submissions:
+                state_entry = state["submissions"][submission.output]
+                if state_entry["result"] is not None:
+                    results[submission.name] = collator.CollationResult.from_dict(state_entry["result"])
+
+    if failed_submissions:
+        if args.generate_combined_spreadsheet or args.marks_export or args.moderation_report or args.marker_bias_report:
+            logging.error("Combined marks not exported as not all collations succeeded!")
+        return failed_submissions
+
+    # previously failed submissions skipped while watching have no marks to combine
+    missing_submissions = [name for name in names if name not in results]
+    if missing_submissions and (args.generate_combined_spreadsheet or args.marks_export or args.moderation_report or args.marker_bias_report):
+        logging.error("Combined marks not exported as \"{}\" has not been collated!".format(missing_submissions[0]))
+        return missing_submissions
+
+    if args.generate_combined_spreadsheet:
+        logging.info("Generating combined spreadsheet.")
+        with profiler.stage("generate_combined_spreadsheet"):
+            generate_combined_spreadsheet(args, names, results)
+
+    if args.marks_export:
+        with profiler.stage("export_marks"):
+            marks_export.export_marks(args.marks_export, submissions, results)
+        logging.info("Marks of all submissions exported to \"{}\"".format(args.marks_export))
+
+    # rank disagreement between markers across the whole cohort ahead of moderation
+    if args.moderation_report or args.marker_bias_report:
+        import moderation
+
+        with profiler.stage("moderation"):
+            statistics = moderation.CohortStatistics(names, results)
+            moderation.log_summary(statistics, args.moderation_threshold)
+            if args.moderation_report:
+                moderation.write_moderation_report(args.moderation_report, statistics, args.moderation_threshold)
+                logging.info("Moderation report saved to \"{}\"".format(args.moderation_report))
+            if args.marker_bias_report:
+                moderation.write_marker_report(args.marker_bias_report, statistics)
+                logging.info("Marker bias report saved to \"{}\"".format(args.marker_bias_report))
+
+    return failed_submissions
 
 
 def main():
 
     # set logging format
-    logging.basicConfig(format='%(asctime)s: %(message)s', datefmt='%d-%b-%y %H:%M:%S', level=logging.INFO)
+    collator.setup_logging()
 
     # extract agruments using argparse standard lib
     args = get_arguments()
@@ -152,11 +601,52 @@ def main():
         logging.error("Cannot use overriding spreadsheet and generate spreadsheet features at the same time!")
         exit(-1)
 
+    # validate against overriding marks from both the combined spreadsheet and a marks file
+    if args.use_combined_spreadsheet and args.override_marks is not None:
+        logging.error("Cannot override marks from both the combined spreadsheet and a marks file!")
+        exit(-1)
+
+    # validate marks file formats before collating anything
+    try:
+        for path in [args.marks_export, args.override_marks]:
+            if path is not None:
+                marks_export.validate_path(path)
+    except collator.CollationError as error:
+        logging.error(error)
+        exit(-1)
+
+    if args.override_marks is not None and not os.path.exists(args.override_marks):
+        logging.error("Overriding marks file \"{}\" does not exist!".format(os.path.join(os.getcwd(), args.override_marks)))
+        exit(-1)
+
     # validate against usage of override with and generate individual spreadsheet flags together
     if args.generate_individual_spreadsheet and args.use_individual_spreadsheet:
         logging.error("Cannot use both use and generate individual spreadsheet flags together!")
         exit(-1)
 
+    # watch mode and resumed builds only rebuild what changed
+    if args.watch or args.resume:
+        args.incremental = True
+
+    # validate moderation threshold
+    if args.moderation_threshold < 0:
+        logging.error("Moderation threshold cannot be negative!")
+        exit(-1)
+
+    # validate number of parallel jobs
+    if args.jobs < 1:
+        logging.error("Number of jobs must be at least 1!")
+        exit(-1)
+
+    # validate submissions are given either as directories or a manifest
+    if bool(args.directories) == (args.manifest is not None):
+        logging.error("Either collation directories or a manifest must be given!")
+        exit(-1)
+
+    if args.manifest is not None and not os.path.exists(args.manifest):
+        logging.error("Manifest \"{}\" does not exist!".format(os.path.join(os.getcwd(), args.manifest)))
+        exit(-1)
+
     directories: list[str] = args.directories
 
     # validate all collation directories are unique
@@ -170,48 +660,40 @@ def main():
             logging.error("Collation directory \"{}\" does not exist!".format(os.path.join(os.getcwd(), directory)))
             exit(-1)
 
-    if args.use_combined_spreadsheet:
-        logging.info("Using combined spreadsheet to override pdf marks.")
-
-        save_directory = os.path.abspath(os.path.join(directories[0], os.pardir))
-        if not os.path.exists(os.path.join(save_directory, "combined_extracted_marks.xlsx")):
-            logging.error("Combined marks spreadsheet does not exist in \"{}\"!".format(save_directory))
-            exit(-1)
-
-        # validate individual projects have extracted marks spreadsheets
-        for directory in directories:
-            if not os.path.exists(os.path.join(directory, "extracted_marks.xlsx")):
-                logging.error("Extracted marks spreadsheet does not exist for \"{}\"!".format(directory))
-                exit(-1)
-
-        use_combined_spreadsheet(args)
-
-    # Dev note: Calling of commands formed from user input is dangerous - should check/sanitise this...
-    for directory in directories:
-        logging.info("Collating {}.".format(directory))
-        command_string = "python collator.py {} {}.pdf".format(directory, os.path.basename(os.path.normpath(directory)))
-
-        if args.generate_individual_spreadsheet or args.generate_combined_spreadsheet:
-            command_string = "{} {}".format(command_string, "--generate-spreadsheet")
-
-        if args.use_individual_spreadsheet or args.use_combined_spreadsheet:
-            command_string = "{} {}".format(command_string, "--use-spreadsheet")
-
-        return_code = subprocess.call(command_string, shell=True)
-        if return_code != 0:
-            logging.error("Collation of \"{}\" failed!".format(directory))
-            exit(-1)
-
-    if args.generate_combined_spreadsheet:
-        logging.info("Generating combined spreadsheet.")
+    if args.watch:
+        logging.info("Watching for changes every {} seconds, press Ctrl+C to stop.".format(args.watch_interval))
+        try:
+            while True:
+                try:
+                    build(args, Profiler(enabled=False))
+                except collator.CollationError as error:
+                    logging.error(error)
+                time.sleep(args.watch_interval)
+        except KeyboardInterrupt:
+            logging.info("Stopped watching.")
+        return
+
+    profiler = Profiler(enabled=args.profile)
+    try:
+        with profiler.stage("build"):
+            failed_submissions = build(args, profiler)
+    except collator.CollationError as error:
+        logging.error(error)
+        exit(-1)
+    except KeyboardInterrupt:
+        logging.error("Collation interrupted, rerun with --resume to continue from the completed submissions.")
+        exit(-1)
 
-        # validate individual projects have extracted marks spreadsheets
-        for directory in directories:
-            if not os.path.exists(os.path.join(directory, "extracted_marks.xlsx")):
-                logging.error("Extracted marks spreadsheet does not exist for \"{}\"!".format(directory))
-                exit(-1)
+    # report stage timings and resource usage aggregated over all submissions
+    if args.profile:
+        profiler.log_summary()
+        if args.profile_json:
+            with open(args.profile_json, "w") as file:
+                json.dump(profiler.to_dict(), file, indent=2)
+            logging.info("Profile saved to \"{}\"".format(args.profile_json))
 
-        generate_combined_spreadsheet(args)
+    if failed_submissions:
+        exit(-1)
 
 
 if __name__ == "__main__":
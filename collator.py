@@ -1,250 +1,325 @@
-import fitz
-
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.chart import BarChart, Reference
-from openpyxl import load_workbook
-
 import glob
 import os
-import collections
-import statistics
+import math
+import shutil
 import argparse
 import logging
+import concurrent.futures
+import collections
+import cProfile
+import contextlib
+import json
+import tempfile
+import typing
+
+import extraction_cache
+import mark_parser
+from mark_parser import MarkParser
+from profiling import Profiler
+from records import MarkComment, FeedbackComment, CollationResult
+
+# fitz, openpyxl and numpy are slow to import so are only imported by the code paths which use them
+if typing.TYPE_CHECKING:
+    import fitz
+    from mark_matrix import MarkMatrix
+
+
+# options passed to fitz.Document.save, incremental saves are handled separately
+SAVE_PROFILES = {
+    "default": {},
+    "compact": {"garbage": 3, "deflate": True, "clean": True},
+}
+
+
+# number of base pdfs each process keeps in memory for reuse between submissions
+TEMPLATE_CACHE_SIZE = 8
+
+templates: collections.OrderedDict[tuple, "Template"] = collections.OrderedDict()
+
+
+class CollationError(Exception):
+    pass
+
+
+# outputs are written to a temporary file beside the target and renamed over it, so an interrupted write never leaves a partial output
+@contextlib.contextmanager
+def atomic_output(path: str):
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(prefix=".{}.".format(name), suffix=".tmp", dir=directory)
+    os.close(descriptor)
+    try:
+        yield temp_path
+
+        # temporary files are private, so take the permissions of the file being replaced or those of a newly created file
+        os.chmod(temp_path, output_mode(path))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
 
+def output_mode(path: str) -> int:
+    try:
+        return os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
 
-class MarkComment():
-    raw_annotation = None
-    author: str = None
-    question_id: str = None
-    mark: float = None
 
-    def __init__(self, raw_annotation):
-        if raw_annotation is None:
-            return
+# every malformed or duplicate marking comment found in a collation, reported together so they can all be fixed at once
+class MarkParseError(CollationError):
 
-        self.raw_annotation = raw_annotation
-        self.author = raw_annotation.info["title"].strip()
-        self.question_id = raw_annotation.info["content"].strip().split(" ")[1]
-        self.mark = float(raw_annotation.info["content"].strip().split(" ")[2])
+    def __init__(self, errors: list[str]):
+        super().__init__(errors)
+        self.errors = errors
 
     def __str__(self):
-        return "Question: {}, Mark: {}, Author: {}".format(self.question_id, self.mark, self.author)
+        return "Found {} malformed or duplicate marking comments!\n{}".format(len(self.errors), "\n".join("  " + error for error in self.errors))
 
 
-class FeedbackComment():
-    raw_annotation = None
-    author: str = None
-    text: str = None
-    page: int = None
-    flags = None
-    rect = None
-    type = None
+# feedback already merged into the output, indexed by (type, page, rounded rect, text) regardless of author
+class CommentIndex():
 
-    def __init__(self, raw_annotation):
-        if raw_annotation is None:
-            return
+    def __init__(self, tolerance: float = 0.0):
+        self.tolerance = tolerance
+        self.duplicates = 0
+        self.near_duplicates = 0
+        self._keys: set[tuple] = set()
+        self._rects: dict[tuple, list[tuple]] = collections.defaultdict(list)
 
-        self.raw_annotation = raw_annotation
-        self.author = raw_annotation.info["title"].strip()
-        self.text = raw_annotation.info["content"].strip()
-        self.page = raw_annotation.parent.number
-        self.rect = [raw_annotation.rect[0], raw_annotation.rect[1], raw_annotation.rect[2], raw_annotation.rect[3]]
-        self.flags = raw_annotation.flags
-        self.type = raw_annotation.type[1]
+    def add(self, comment: FeedbackComment) -> bool:
+        rect = tuple(round(value, 1) for value in comment.rect)
+        if (comment.type, comment.page, rect, comment.text) in self._keys:
+            self.duplicates += 1
+            return False
 
+        # near duplicates share everything but geometry, so only the rects with the same type, page and text are compared
+        rects = self._rects[(comment.type, comment.page, comment.text)]
+        if self.tolerance > 0 and any(all(abs(a - b) <= self.tolerance for a, b in zip(rect, other)) for other in rects):
+            self.near_duplicates += 1
+            return False
 
-def get_arguments():
+        self._keys.add((comment.type, comment.page, rect, comment.text))
+        rects.append(rect)
+        return True
+
+
+    def copy(self, tolerance: float) -> "CommentIndex":
+        index = CommentIndex(tolerance)
+        index._keys = set(self._keys)
+        index._rects = collections.defaultdict(list, {key: list(rects) for key, rects in self._rects.items()})
+        return index
+
+
+# base pdf read once per process and shared by every submission marked from the same template
+class Template():
+    __slots__ = ("data", "index")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.index: CommentIndex = None
+
+
+def get_arguments(argv: list[str] = None):
     parser = argparse.ArgumentParser()
     parser.add_argument("input_dir", metavar="input-dir", type=str, help="directory of pdf collection")
     parser.add_argument("input_file", metavar="input-file", type=str, help="name of base pdf")
     parser.add_argument("--output-file", type=str, help="name of output pdf", default="output.pdf")
+    parser.add_argument("--marked-files", type=str, nargs="+", help="marked pdfs to collate instead of every other pdf in the input directory", default=None)
+    parser.add_argument("--spreadsheet-file", type=str, help="name of generated or used marks spreadsheet", default="extracted_marks.xlsx")
     parser.add_argument("--comment-prefix-flag", type=str, help="comment prefix which flags marks", default="!#")
+    parser.add_argument("--mark-grammar", type=str, help="format of marking comments, either one of {} or a regular expression with question and mark groups".format(", ".join(mark_parser.GRAMMARS)), default="simple")
     parser.add_argument("--alias-authors", type=bool, help="replace author names with alias", default=True, action=argparse.BooleanOptionalAction)
     parser.add_argument("--generate-spreadsheet", type=bool, help="generate spreadsheet of extracted marks", default=False, action=argparse.BooleanOptionalAction)
     parser.add_argument("--use-spreadsheet", type=bool, help="use spreadsheet of marks inplace of pdf markings", default=False, action=argparse.BooleanOptionalAction)
-    return parser.parse_args()
+    parser.add_argument("--spreadsheet-charts", type=bool, help="include bar charts of marks in generated spreadsheets", default=True, action=argparse.BooleanOptionalAction)
+    parser.add_argument("--deduplicate", type=bool, help="drop feedback annotations identical to one already merged", default=True, action=argparse.BooleanOptionalAction)
+    parser.add_argument("--coalesce-tolerance", type=float, help="also drop feedback annotations within this many points of one already merged", default=0.0)
+    parser.add_argument("--save-profile", type=str, help="how the output pdf is saved", choices=list(SAVE_PROFILES) + ["incremental"], default="default")
+    parser.add_argument("--workers", type=int, help="number of processes used to extract annotations from pdf files", default=1)
+    parser.add_argument("--cache", type=bool, help="cache extracted annotations of unchanged pdf files", default=True, action=argparse.BooleanOptionalAction)
+    parser.add_argument("--cache-dir", type=str, help="directory of extraction cache", default=extraction_cache.DEFAULT_CACHE_DIR)
+    parser.add_argument("--cache-max-size", type=float, help="maximum size of extraction cache in megabytes", default=256.0)
+    parser.add_argument("--cache-max-age", type=float, help="maximum age of unused extraction cache entries in days", default=30.0)
+    parser.add_argument("--profile", type=bool, help="report time and peak memory of each collation stage", default=False, action=argparse.BooleanOptionalAction)
+    parser.add_argument("--profile-json", type=str, help="file to write the stage profile to as json", default=None)
+    parser.add_argument("--cprofile", type=str, help="file to write cProfile statistics of the collation to", default=None)
+    return parser.parse_args(argv)
+
+
+def setup_logging():
+    logging.basicConfig(format='%(asctime)s: %(message)s', datefmt='%d-%b-%y %H:%M:%S', level=logging.INFO)
 
 
-def generate_spreadsheet(args, authors: list[str], aliases: list[str], all_marks: list[list[MarkComment]], question_ids: list[str]):
-    wb = Workbook()
-    ws = wb.active
+def generate_spreadsheet(args, result: CollationResult):
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+    from openpyxl.chart import BarChart, Reference
+
+    # rows are streamed in order to a write only workbook so memory stays bounded
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+
+    authors = result.matrix.authors
+    question_ids = result.matrix.question_ids
+    marks = result.matrix.to_rows()
 
     # write aliases and author names
-    ws.cell(column=2, row=2, value="Alias")
-    ws.cell(column=2, row=3, value="Authors")
-    for col in range(len(authors)):
-        ws.cell(column=col+3, row=3, value="{0}".format(authors[col]))
-        if args.alias_authors:
-            ws.cell(column=col+3, row=2, value="{0}".format(aliases[authors[col]]))
-
-    # write question ids and total label
+    ws.append([])
+    ws.append([None, "Alias"] + ["{0}".format(result.aliases[author]) if author in result.aliases else None for author in authors])
+    ws.append([None, "Authors"] + ["{0}".format(author) for author in authors] + [None, "Average"])
+
+    # write question ids, the individual marks from markers and formulae to average the marks of each question
     for i in range(len(question_ids)):
-        ws.cell(column=2, row=4+i, value="Q: {}".format(question_ids[i]))
-    ws.cell(column=2, row=4+len(question_ids)+1, value="Total")
+        ws.append([None, "Q: {}".format(question_ids[i])] + marks[i] + [None, "=AVERAGE({}{}:{}{})".format("C", 4+i, get_column_letter(2+len(authors)), 4+i)])
+    ws.append([])
 
     # write formulae to calculate totals of author and average marks
-    for i in range(len(authors)):
-        ws.cell(column=i+3, row=4+len(question_ids)+1).value = "=SUM({}{}:{}{})".format(get_column_letter(3+i), 4, get_column_letter(3+i), 3+len(question_ids))
-    ws.cell(column=4+len(authors), row=4+len(question_ids)+1).value = "=SUM({}{}:{}{})".format(get_column_letter(4+len(authors)), 4, get_column_letter(4+len(authors)), 3+len(question_ids))
-
-    # write the individual marks from markers
-    for document_marks in all_marks:
-        for mark in document_marks:
-            row_index = question_ids.index(mark.question_id)
-            column_index = authors.index(mark.author)
-            ws.cell(column=3+column_index, row=4+row_index).value = mark.mark
-
-    # write formulae to average the marks of each question
-    ws.cell(column=3+len(authors)+1, row=3, value="Average")
-    for i in range(len(question_ids)):
-        ws.cell(column=3+len(authors)+1, row=4+i, value="=AVERAGE({}{}:{}{})".format("C", 4+i, get_column_letter(2+len(authors)), 4+i))
+    totals = ["=SUM({}{}:{}{})".format(get_column_letter(3+i), 4, get_column_letter(3+i), 3+len(question_ids)) for i in range(len(authors))]
+    ws.append([None, "Total"] + totals + [None, "=SUM({}{}:{}{})".format(get_column_letter(4+len(authors)), 4, get_column_letter(4+len(authors)), 3+len(question_ids))])
 
     # create bar chart for marking data visualisation
-    chart = BarChart()
-    chart.type = "col"
-    chart.style = 10
-    chart.y_axis.title = "Mark Given"
-    chart.x_axis.title = "Question ID"
-    data = Reference(ws, min_col=3, min_row=3, max_row=len(question_ids)+3, max_col=len(authors)+2)
-    cats = Reference(ws, min_col=2, min_row=4, max_row=len(question_ids)+3)
-    chart.add_data(data, titles_from_data=True)
-    chart.set_categories(cats)
-    chart.shape = 4
-    ws.add_chart(chart, "{}{}".format(get_column_letter(len(authors)+6), 2))
+    if args.spreadsheet_charts:
+        chart = BarChart()
+        chart.type = "col"
+        chart.style = 10
+        chart.y_axis.title = "Mark Given"
+        chart.x_axis.title = "Question ID"
+        data = Reference(ws, min_col=3, min_row=3, max_row=len(question_ids)+3, max_col=len(authors)+2)
+        cats = Reference(ws, min_col=2, min_row=4, max_row=len(question_ids)+3)
+        chart.add_data(data, titles_from_data=True)
+        chart.set_categories(cats)
+        chart.shape = 4
+        ws.add_chart(chart, "{}{}".format(get_column_letter(len(authors)+6), 2))
 
     # save spreadsheet
-    wb.save(filename=os.path.join(os.getcwd(), args.input_dir, "extracted_marks.xlsx"))
+    with atomic_output(os.path.join(os.getcwd(), args.input_dir, args.spreadsheet_file)) as temp_path:
+        wb.save(filename=temp_path)
 
 
-def read_spreadsheet(args, authors, question_ids):
-    wb = load_workbook(os.path.join(os.getcwd(), args.input_dir, "extracted_marks.xlsx"))
+def read_spreadsheet(args, authors, question_ids) -> "MarkMatrix":
+    from openpyxl import load_workbook
+    from mark_matrix import MarkMatrix
+
+    wb = load_workbook(os.path.join(os.getcwd(), args.input_dir, args.spreadsheet_file), read_only=True)
     ws = wb.active
 
     # read grid of marks
-    overriding_marks: list[list[MarkComment]] = []
-    for col in range(len(authors)):
-        marks: list[MarkComment] = []
-        for row in range(len(question_ids)):
-            mark_comment = MarkComment(None)
-            mark_comment.author = authors[col]
-            mark_comment.question_id = question_ids[row]
-            mark_comment.mark = ws.cell(row+4, col+3).value
-            marks.append(mark_comment)
-        overriding_marks.append(marks)
+    overriding_marks = MarkMatrix()
+    for row, values in enumerate(ws.iter_rows(min_row=4, max_row=3+len(question_ids), min_col=3, max_col=2+len(authors), values_only=True)):
+        for col in range(len(authors)):
+            overriding_marks.add_mark(question_ids[row], authors[col], values[col])
+    wb.close()
 
     return overriding_marks
 
 
-def main():
-
-    # set logging format
-    logging.basicConfig(format='%(asctime)s: %(message)s', datefmt='%d-%b-%y %H:%M:%S', level=logging.INFO)
+def annotated_pages(document: "fitz.Document") -> list[int]:
 
-    # extract agruments using argparse standard lib
-    args = get_arguments()
+    # check each page object's /Annots entry directly so pages without annotations are never loaded
+    page_numbers: list[int] = []
+    for page_number in range(document.page_count):
+        value_type, value = document.xref_get_key(document.page_xref(page_number), "Annots")
+        if value_type == "null" or (value_type == "array" and value.strip("[] ") == ""):
+            continue
+        page_numbers.append(page_number)
+    return page_numbers
 
-    # validate input directory
-    if not os.path.exists(os.path.join(os.getcwd(), args.input_dir)):
-        logging.error("Input directory \"{}\" does not exist!".format(os.path.join(os.getcwd(), args.input_dir)))
-        exit(-1)
 
-    # validate input file
-    if not os.path.exists(os.path.join(os.getcwd(), args.input_dir, args.input_file)):
-        logging.error("Input file \"{}\" does not exist!".format(os.path.join(os.getcwd(), args.input_dir, args.input_file)))
-        exit(-1)
+# malformed marks are recorded as (page, content, author, reason) without the file, as identical files share cache entries
+def format_mark_error(pdf: str, error: tuple[int, str, str, str]) -> str:
+    page_number, content, author, reason = error
+    return "\"{}\" page {}: \"{}\" by {}, {}".format(pdf, page_number, content, author, reason)
 
-    # validate against usage of override with and generation of spreadsheets together
-    if args.generate_spreadsheet and args.use_spreadsheet:
-        logging.error("Cannot use overriding spreadsheet and generate spreadsheet features at the same time!")
-        exit(-1)
 
-    logging.info("Collating all pdf's in \"{}\" using \"{}\" as base".format(os.path.join(os.getcwd(), args.input_dir), os.path.join(os.getcwd(), args.input_dir, args.input_file)))
+def extract_document(pdf: str, parser: MarkParser, cache_dir: str = None, profiler: Profiler = None) -> tuple[list[MarkComment], list[FeedbackComment], list[tuple[int, str, str, str]]]:
+    profiler = profiler or Profiler(enabled=False)
 
-    # get list of pdf files in collection, remove base and output files
-    pdf_collection = glob.glob(os.path.join(os.getcwd(), args.input_dir, "*.pdf"))
-    pdf_collection.remove(os.path.join(os.getcwd(), args.input_dir, args.input_file))
-    if os.path.join(os.getcwd(), args.input_dir, args.output_file) in pdf_collection:
-        pdf_collection.remove(os.path.join(os.getcwd(), args.input_dir, args.output_file))
+    # skip parsing entirely when an identical pdf has already been extracted
+    if cache_dir is not None:
+        with profiler.stage("cache_lookup", pdf):
+            key = extraction_cache.cache_key(pdf, parser.comment_prefix_flag, parser.grammar)
+            cached = extraction_cache.load_entry(cache_dir, key)
+        if cached is not None:
+            logging.debug("Loaded \"{}\" from extraction cache".format(pdf))
+            return cached
 
-    all_marks: list[list[MarkComment]] = []
-    all_comments: list[list[FeedbackComment]] = []
+    import fitz
 
-    # extract marking and feedback annotations from pdf files
-    for pdf in pdf_collection:
-        logging.debug("Reading \"{}\"".format(pdf))
+    logging.debug("Reading \"{}\"".format(pdf))
+    with profiler.stage("open_pdf", pdf):
         document = fitz.open(pdf)
-        document_marks: list[MarkComment] = []
-        document_comments: list[FeedbackComment] = []
-        for page in document:
+    document_marks: list[MarkComment] = []
+    document_comments: list[FeedbackComment] = []
+    errors: list[tuple[int, str, str, str]] = []
+    with profiler.stage("find_annotated_pages", pdf):
+        page_numbers = annotated_pages(document)
+
+    # markers sometimes return an untouched copy, in which case there is nothing to parse
+    if not page_numbers:
+        logging.debug("No annotations found in \"{}\"".format(pdf))
+
+    with profiler.stage("parse_annotations", pdf):
+        for page_number in page_numbers:
+            page = document.load_page(page_number)
             for annotation in page.annots():
-                if annotation.info["content"].strip().startswith(args.comment_prefix_flag):
-                    try:
-                        document_marks.append(MarkComment(annotation))
-                    except:
-                        logging.error("Unable to parse marking comment \"{}\" in \"{}\"!".format(annotation.info["content"].strip(), pdf))
-                        exit(-1)
-                else:
+                info = annotation.info
+                if not parser.is_mark(info["content"]):
                     document_comments.append(FeedbackComment(annotation))
-        document.close()
-        all_marks.append(document_marks)
-        all_comments.append(document_comments)
+                    continue
+
+                # malformed marks are collected rather than raised so every error in a collation is reported together
+                author = info["title"].strip()
+                try:
+                    for question_id, mark in parser.parse(info["content"]):
+                        document_marks.append(MarkComment(author, question_id, mark))
+                except ValueError as error:
+                    errors.append((page_number + 1, info["content"].strip(), author, str(error)))
+    document.close()
 
-    # extract a list of authors
-    authors: list[str] = []
-    total_comments = 0
-    for document_marks in all_marks:
-        for mark in document_marks:
-            if mark.author not in authors:
-                authors.append(mark.author)
-    for document_comments in all_comments:
-        total_comments += len(document_comments)
-        for comment in document_comments:
-            if comment.author not in authors:
-                authors.append(comment.author)
-
-    # extract list of question ids
-    question_ids: list[str] = []
-    for document_marks in all_marks:
-        for mark in document_marks:
-            if mark.question_id not in question_ids:
-                question_ids.append(mark.question_id)
-    question_ids.sort()
+    if cache_dir is not None:
+        with profiler.stage("cache_store", pdf):
+            extraction_cache.store_entry(cache_dir, key, (document_marks, document_comments, errors))
 
-    logging.info("Extracted {} total comments from {} authors in {} files.".format(total_comments, len(authors), len(pdf_collection)))
+    return document_marks, document_comments, errors
 
-    # generate author aliases
-    if args.alias_authors:
-        logging.info("Replacing author names.")
-        aliases: dict[str, str] = {}
-        for i in range(len(authors)):
-            aliases[authors[i]] = "Marker #{}".format(i+1)
 
-    # override marks using spreadsheet
-    if args.use_spreadsheet:
-        logging.info("Using spreadsheet to override marking values.")
-        all_marks = read_spreadsheet(args, authors, question_ids)
+def profile_extract_document(pdf: str, parser: MarkParser, cache_dir: str, profile: bool) -> tuple[tuple[list[MarkComment], list[FeedbackComment], list[tuple[int, str, str, str]]], Profiler]:
 
-    # calculate average marks
-    averaged_marks: dict[str, float] = {}
-    extracted_marks: dict[str, list[float]] = {}
-    total_averaged_mark = 0.0
-    for document_marks in all_marks:
-        for mark in document_marks:
-            if mark.question_id not in extracted_marks:
-                extracted_marks[mark.question_id] = []
-            extracted_marks[mark.question_id].append(mark.mark)
-    for question in extracted_marks:
-        averaged_marks[question] = statistics.mean(extracted_marks[question])
-        total_averaged_mark += averaged_marks[question]
-
-    averaged_marks = collections.OrderedDict(sorted(averaged_marks.items()))
-
-    # write collated feedback and marking annotations to a clean pdf file
-    document = fitz.open(os.path.join(os.getcwd(), args.input_dir, args.input_file))
-    for document_comments in all_comments:
-        for comment in document_comments:
-            page = document[comment.page]
+    # worker processes record into their own profiler which is returned alongside the extracted annotations
+    profiler = Profiler(enabled=profile)
+    return extract_document(pdf, parser, cache_dir, profiler), profiler
+
+
+def extract_documents(pdf_collection: list[str], parser: MarkParser, cache_dir: str, workers: int, profiler: Profiler):
+
+    # yield extracted annotations in file order, keeping at most one result per worker waiting to be consumed
+    if workers > 1 and len(pdf_collection) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(pdf_collection))) as executor:
+            pending = collections.deque()
+            for pdf in pdf_collection:
+                pending.append(executor.submit(profile_extract_document, pdf, parser, cache_dir, profiler.enabled))
+                while len(pending) >= workers or (pending and pdf is pdf_collection[-1]):
+                    extracted, worker_profiler = pending.popleft().result()
+                    profiler.merge(worker_profiler)
+                    yield extracted
+    else:
+        for pdf in pdf_collection:
+            yield extract_document(pdf, parser, cache_dir, profiler)
+
+
+def write_comments(args, document, document_comments: list[FeedbackComment], aliases: dict[str, str]):
+
+    # visit each page once, annotations are created with their appearance so no further update is needed
+    comments_by_page: dict[int, list[FeedbackComment]] = collections.defaultdict(list)
+    for comment in document_comments:
+        comments_by_page[comment.page].append(comment)
+
+    for page_number in sorted(comments_by_page):
+        page = document.load_page(page_number)
+        for comment in comments_by_page[page_number]:
             if comment.type == "Text" or comment.type == "FreeText":
                 annotation = page.add_text_annot([comment.rect[0], comment.rect[1]], comment.text, "Comment")
             elif comment.type == "Highlight":
@@ -263,7 +338,66 @@ def main():
             else:
                 annotation.set_info(content=comment.text, title=comment.author)
             annotation.set_flags(comment.flags)
-            annotation.update()
+
+
+def load_template(path: str) -> Template:
+
+    # keyed on size and modification time as well as path so edited templates are read again
+    status = os.stat(path)
+    key = (os.path.abspath(path), status.st_size, status.st_mtime_ns)
+    if key in templates:
+        templates.move_to_end(key)
+        return templates[key]
+
+    with open(path, "rb") as file:
+        template = Template(file.read())
+    templates[key] = template
+    if len(templates) > TEMPLATE_CACHE_SIZE:
+        templates.popitem(last=False)
+    return template
+
+
+def open_base_document(args, template: Template, output_path: str) -> tuple["fitz.Document", bool]:
+    import fitz
+
+    base_path = os.path.join(os.getcwd(), args.input_dir, args.input_file)
+    if args.save_profile != "incremental":
+        return fitz.open(stream=template.data, filetype="pdf"), False
+
+    # incremental saves append to a copy of the base document rather than rewriting it, the copy replaces the output once saved
+    shutil.copyfile(base_path, incremental_path(output_path))
+    document = fitz.open(incremental_path(output_path))
+    if not document.can_save_incrementally():
+        logging.warning("\"{}\" cannot be saved incrementally, using default save profile.".format(base_path))
+        discard_document(document, output_path, True)
+        return fitz.open(stream=template.data, filetype="pdf"), False
+    return document, True
+
+
+def incremental_path(output_path: str) -> str:
+    directory, name = os.path.split(output_path)
+    return os.path.join(directory, ".{}.incremental.tmp".format(name))
+
+
+def discard_document(document: "fitz.Document", output_path: str, incremental: bool):
+    document.close()
+    if incremental and os.path.exists(incremental_path(output_path)):
+        os.remove(incremental_path(output_path))
+
+
+def index_document(document: "fitz.Document", index: CommentIndex):
+
+    # annotations already in the base document, such as those of a shared template, are not merged again
+    for page_number in annotated_pages(document):
+        for annotation in document.load_page(page_number).annots():
+            index.add(FeedbackComment(annotation))
+
+
+def write_summary(document, matrix: "MarkMatrix"):
+
+    # calculate average marks
+    averaged_marks = matrix.means()
+    total_averaged_mark = matrix.total()
 
     # write total mark annotation
     page = document[0]
@@ -274,22 +408,256 @@ def main():
 
     # write annotation of the average mark of each question
     index = 0
-    for key, value in averaged_marks.items():
+    for key, value in zip(matrix.question_ids, averaged_marks):
+        if math.isnan(value):
+            continue
         mark_annotation = page.add_text_annot([25.0, 70.0 + 20.0*index], "Question {}: {:.2f}".format(key, value))
         mark_annotation.set_info(title="Markers")
         mark_annotation.set_colors({"stroke": (1.0, 0.0, 0.0), "fill": None})
         mark_annotation.update()
         index += 1
 
+
+def save_document(args, document, output_path: str, incremental: bool):
+    if incremental:
+        document.saveIncr()
+    else:
+        with atomic_output(output_path) as temp_path:
+            document.save(temp_path, **SAVE_PROFILES.get(args.save_profile, {}))
+
+
+def evict_cache(args):
+    if args.cache:
+        extraction_cache.evict_entries(args.cache_dir, args.cache_max_size * 1024 * 1024, args.cache_max_age * 24 * 60 * 60)
+
+
+def collate_directory(args, overriding_marks: "MarkMatrix" = None, overriding_source: str = None, keep_missing: bool = False) -> CollationResult:
+
+    # validate input directory
+    if not os.path.exists(os.path.join(os.getcwd(), args.input_dir)):
+        raise CollationError("Input directory \"{}\" does not exist!".format(os.path.join(os.getcwd(), args.input_dir)))
+
+    # validate input file
+    if not os.path.exists(os.path.join(os.getcwd(), args.input_dir, args.input_file)):
+        raise CollationError("Input file \"{}\" does not exist!".format(os.path.join(os.getcwd(), args.input_dir, args.input_file)))
+
+    # validate marked files
+    for pdf in args.marked_files or []:
+        if not os.path.exists(os.path.join(os.getcwd(), pdf)):
+            raise CollationError("Marked file \"{}\" does not exist!".format(os.path.join(os.getcwd(), pdf)))
+
+    # validate against usage of override with and generation of spreadsheets together
+    if args.generate_spreadsheet and args.use_spreadsheet:
+        raise CollationError("Cannot use overriding spreadsheet and generate spreadsheet features at the same time!")
+
+    # validate overriding spreadsheet
+    if args.use_spreadsheet and not os.path.exists(os.path.join(os.getcwd(), args.input_dir, args.spreadsheet_file)):
+        raise CollationError("Spreadsheet file \"{}\" does not exist!".format(os.path.join(os.getcwd(), args.input_dir, args.spreadsheet_file)))
+
+    # validate number of extraction workers
+    if args.workers < 1:
+        raise CollationError("Number of workers must be at least 1!")
+
+    # validate tolerance of near duplicate feedback
+    if args.coalesce_tolerance < 0:
+        raise CollationError("Coalesce tolerance cannot be negative!")
+
+    # validate mark grammar
+    try:
+        MarkParser(args.comment_prefix_flag, args.mark_grammar)
+    except ValueError as error:
+        raise CollationError(str(error))
+
+    profiler = Profiler(enabled=args.profile)
+
+    # optionally capture a full cProfile of the collation alongside the stage timings
+    cprofile = cProfile.Profile() if args.cprofile else None
+    if cprofile is not None:
+        cprofile.enable()
+    try:
+        with profiler.stage("collate_directory"):
+            result = collate_documents(args, overriding_marks, profiler, overriding_source, keep_missing)
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(args.cprofile)
+
+    if args.profile:
+        result.profile = profiler
+
+    return result
+
+
+def aggregate_marks(args, matrix: "MarkMatrix", aliases: dict[str, str], sources: dict[tuple[str, str], str], pdf: str, document_marks: list[MarkComment], document_comments: list[FeedbackComment]) -> list[str]:
+    errors: list[str] = []
+
+    # intern authors of marks before authors of feedback, a marker giving one question several marks is an error rather than one of the marks being used
+    for mark in document_marks:
+        if (mark.question_id, mark.author) in sources:
+            errors.append("\"{}\": question {} marked again by {}, already marked in \"{}\"".format(pdf, mark.question_id, mark.author, sources[(mark.question_id, mark.author)]))
+            continue
+        sources[(mark.question_id, mark.author)] = pdf
+        matrix.add_mark(mark.question_id, mark.author, mark.mark)
+    for comment in document_comments:
+        matrix.add_author(comment.author)
+
+    # generate aliases for newly seen authors
+    if args.alias_authors:
+        for author in matrix.authors[len(aliases):]:
+            aliases[author] = "Marker #{}".format(len(aliases)+1)
+
+    return errors
+
+
+def override_sources(original: "MarkMatrix", overridden: "MarkMatrix", sources: dict[tuple[str, str], str], overriding_source: str) -> dict[tuple[str, str], str]:
+
+    # marks changed by an override come from the override, unchanged marks keep their marked pdf and removed marks have no source
+    overridden_sources: dict[tuple[str, str], str] = {}
+    for question_id, original_row, row in zip(overridden.question_ids, original.to_rows(), overridden.to_rows()):
+        for author, original_mark, mark in zip(overridden.authors, original_row, row):
+            if mark is not None:
+                overridden_sources[(question_id, author)] = sources.get((question_id, author)) if mark == original_mark else overriding_source
+    return overridden_sources
+
+
+def collate_documents(args, overriding_marks: "MarkMatrix", profiler: Profiler, overriding_source: str = None, keep_missing: bool = False) -> CollationResult:
+    if args.marked_files is not None:
+        logging.info("Collating {} marked pdf's using \"{}\" as base".format(len(args.marked_files), os.path.join(os.getcwd(), args.input_dir, args.input_file)))
+    else:
+        logging.info("Collating all pdf's in \"{}\" using \"{}\" as base".format(os.path.join(os.getcwd(), args.input_dir), os.path.join(os.getcwd(), args.input_dir, args.input_file)))
+
+    # get sorted list of pdf files in collection, remove base and output files
+    if args.marked_files is not None:
+        pdf_collection = [os.path.join(os.getcwd(), pdf) for pdf in args.marked_files]
+    else:
+        pdf_collection = sorted(glob.glob(os.path.join(os.getcwd(), args.input_dir, "*.pdf")))
+        pdf_collection.remove(os.path.join(os.getcwd(), args.input_dir, args.input_file))
+        if os.path.join(os.getcwd(), args.input_dir, args.output_file) in pdf_collection:
+            pdf_collection.remove(os.path.join(os.getcwd(), args.input_dir, args.output_file))
+
+    cache_dir = args.cache_dir if args.cache else None
+    parser = MarkParser(args.comment_prefix_flag, args.mark_grammar)
+    return collate_extracted(args, pdf_collection, extract_documents(pdf_collection, parser, cache_dir, args.workers, profiler), overriding_marks, profiler, overriding_source, keep_missing)
+
+
+# merge annotations already extracted from each marked pdf, in file order, into the base document
+def collate_extracted(args, pdf_collection: list[str], extracted, overriding_marks: "MarkMatrix", profiler: Profiler, overriding_source: str = None, keep_missing: bool = False) -> CollationResult:
+    from mark_matrix import MarkMatrix
+
+    # open the base document first so each marked pdf can be merged in as soon as it is read
+    output_path = os.path.join(os.getcwd(), args.input_dir, args.output_file)
+    with profiler.stage("open_base"):
+        template = load_template(os.path.join(os.getcwd(), args.input_dir, args.input_file))
+        document, incremental = open_base_document(args, template, output_path)
+
+    if args.alias_authors:
+        logging.info("Replacing author names.")
+
+    index = CommentIndex(args.coalesce_tolerance)
+    if args.deduplicate:
+        with profiler.stage("index_base"):
+            if template.index is None:
+                template.index = CommentIndex()
+                index_document(document, template.index)
+            index = template.index.copy(args.coalesce_tolerance)
+
+    # extract marking and feedback annotations from pdf files in file order, writing feedback straight to the base document
+    matrix = MarkMatrix()
+    aliases: dict[str, str] = {}
+    sources: dict[tuple[str, str], str] = {}
+    total_comments = 0
+    errors: list[str] = []
+    try:
+        for pdf, (document_marks, document_comments, document_errors) in zip(pdf_collection, extracted):
+
+            # keep extracting after a malformed mark to find the rest, but stop writing output
+            errors.extend(format_mark_error(pdf, error) for error in document_errors)
+            errors.extend(aggregate_marks(args, matrix, aliases, sources, pdf, document_marks, document_comments))
+            if errors:
+                continue
+
+            total_comments += len(document_comments)
+            if args.deduplicate:
+                with profiler.stage("deduplicate_comments", pdf):
+                    document_comments = [comment for comment in document_comments if index.add(comment)]
+            with profiler.stage("write_comments", pdf):
+                write_comments(args, document, document_comments, aliases)
+    except BaseException:
+        discard_document(document, output_path, incremental)
+        raise
+
+    if errors:
+        discard_document(document, output_path, incremental)
+        raise MarkParseError(errors)
+
+    authors = matrix.authors
+
+    logging.info("Extracted {} total comments from {} authors in {} files.".format(total_comments, len(authors), len(pdf_collection)))
+    if args.deduplicate:
+        logging.info("Removed {} duplicate and {} near duplicate comments.".format(index.duplicates, index.near_duplicates))
+
+    # override marks using spreadsheet or marks provided by the caller
+    if args.use_spreadsheet:
+        logging.info("Using spreadsheet to override marking values.")
+        with profiler.stage("read_spreadsheet"):
+            overridden = matrix.override(read_spreadsheet(args, authors, matrix.question_ids))
+        sources = override_sources(matrix, overridden, sources, os.path.join(os.getcwd(), args.input_dir, args.spreadsheet_file))
+        matrix = overridden
+    elif overriding_marks is not None:
+        logging.info("Using provided marks to override marking values.")
+        unmatched = matrix.unmatched(overriding_marks)
+        if unmatched:
+            logging.warning("Ignored {} overriding marks which match no extracted question and marker, such as question \"{}\" by \"{}\".".format(len(unmatched), *unmatched[0]))
+        overridden = matrix.override(overriding_marks, keep_missing)
+        sources = override_sources(matrix, overridden, sources, overriding_source)
+        matrix = overridden
+
+    # write summary of averaged marks
+    with profiler.stage("write_summary"):
+        write_summary(document, matrix)
+
     # save to an output pdf file
-    document.save(os.path.join(os.getcwd(), args.input_dir, args.output_file))
+    with profiler.stage("save_pdf"):
+        save_document(args, document, output_path, incremental)
     document.close()
-    logging.info("Collated pdf saved to \"{}\"".format(os.path.join(os.getcwd(), args.input_dir, args.output_file)))
+    if incremental:
+        os.replace(incremental_path(output_path), output_path)
+    logging.info("Collated pdf saved to \"{}\"".format(output_path))
+
+    result = CollationResult(output_path, aliases, matrix, sources)
 
     # generate spreadsheet of marks
     if args.generate_spreadsheet:
         logging.info("Generating spreadsheet of extracted marks.")
-        generate_spreadsheet(args, authors, aliases, all_marks, question_ids)
+        with profiler.stage("generate_spreadsheet"):
+            generate_spreadsheet(args, result)
+
+    return result
+
+
+def main():
+
+    # set logging format
+    setup_logging()
+
+    # extract agruments using argparse standard lib
+    args = get_arguments()
+
+    try:
+        result = collate_directory(args)
+    except CollationError as error:
+        logging.error(error)
+        exit(-1)
+    finally:
+        evict_cache(args)
+
+    # report stage timings and resource usage
+    if args.profile:
+        result.profile.log_summary()
+        if args.profile_json:
+            with open(args.profile_json, "w") as file:
+                json.dump(result.profile.to_dict(), file, indent=2)
+            logging.info("Profile saved to \"{}\"".format(args.profile_json))
 
 
 if __name__ == "__main__":
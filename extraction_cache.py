@@ -0,0 +1,100 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+import logging
+
+
+# bump whenever the cached record format changes so stale entries are never loaded
+CACHE_VERSION = 5
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pdf-marking-collator")
+
+ENTRY_SUFFIX = ".pickle"
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(path: str, *options) -> str:
+    digest = hashlib.sha256()
+    digest.update(str(CACHE_VERSION).encode())
+    digest.update(hash_file(path).encode())
+    for option in options:
+        digest.update(b"\0")
+        digest.update(str(option).encode())
+    return digest.hexdigest()
+
+
+def load_entry(cache_dir: str, key: str):
+    path = os.path.join(cache_dir, key + ENTRY_SUFFIX)
+    try:
+        with open(path, "rb") as file:
+            entry = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        logging.warning("Ignoring unreadable cache entry \"{}\".".format(path))
+        return None
+
+    # refresh modification time so eviction removes least recently used entries first
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return entry
+
+
+def store_entry(cache_dir: str, key: str, entry):
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # write to a temporary file and rename so concurrent readers never see partial entries
+    file_descriptor, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, os.path.join(cache_dir, key + ENTRY_SUFFIX))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def evict_entries(cache_dir: str, max_size: int, max_age: float):
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(ENTRY_SUFFIX):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            status = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((status.st_mtime, status.st_size, path))
+
+    # remove entries older than the maximum age, then least recently used until under the size limit
+    entries.sort()
+    expiry_time = time.time() - max_age
+    total_size = sum(size for _, size, _ in entries)
+    removed = 0
+    for modified_time, size, path in entries:
+        if modified_time >= expiry_time and total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        removed += 1
+
+    if removed > 0:
+        logging.info("Evicted {} entries from extraction cache.".format(removed))
@@ -0,0 +1,68 @@
+import csv
+import glob
+import json
+import os
+
+import collator
+
+
+# a single submission to collate, paths are absolute once loaded
+class Submission():
+    __slots__ = ("name", "base", "markers", "output", "spreadsheet")
+
+    def __init__(self, name: str, base: str, markers: list[str], output: str, spreadsheet: str = None):
+        self.name = name
+        self.base = base
+        self.markers = markers
+        self.output = output
+        self.spreadsheet = spreadsheet if spreadsheet is not None else os.path.splitext(output)[0] + ".xlsx"
+
+    def to_dict(self) -> dict:
+        return {"submission": self.name, "base": self.base, "markers": self.markers, "output": self.output, "spreadsheet": self.spreadsheet}
+
+
+def directory_submission(directory: str) -> Submission:
+
+    # base file is assumed to share the directory name, every other pdf apart from the output is a marked copy
+    base = os.path.abspath(os.path.join(directory, "{}.pdf".format(os.path.basename(os.path.normpath(directory)))))
+    output = os.path.abspath(os.path.join(directory, "output.pdf"))
+    markers = [pdf for pdf in sorted(glob.glob(os.path.join(os.path.abspath(directory), "*.pdf"))) if pdf != base and pdf != output]
+    return Submission(directory, base, markers, output, os.path.abspath(os.path.join(directory, "extracted_marks.xlsx")))
+
+
+def load_manifest(path: str) -> list[Submission]:
+
+    # csv manifests have one row per submission with marked pdfs separated by semicolons
+    try:
+        with open(path, "r", newline="") as file:
+            if os.path.splitext(path)[1].lower() == ".json":
+                entries = json.load(file)
+            else:
+                entries = [dict(row, markers=[marker.strip() for marker in (row.get("markers") or "").split(";") if marker.strip()]) for row in csv.DictReader(file)]
+    except (OSError, ValueError, csv.Error) as error:
+        raise collator.CollationError("Unable to read manifest \"{}\": {}".format(path, error))
+
+    # paths are relative to the manifest rather than the working directory
+    root = os.path.dirname(os.path.abspath(path))
+    submissions: list[Submission] = []
+    for number, entry in enumerate(entries, start=1):
+        missing = [field for field in ("submission", "base", "markers", "output") if not entry.get(field)]
+        if missing:
+            raise collator.CollationError("Submission {} of manifest \"{}\" is missing {}!".format(number, path, ", ".join(missing)))
+        spreadsheet = os.path.join(root, entry["spreadsheet"]) if entry.get("spreadsheet") else None
+        submissions.append(Submission(str(entry["submission"]), os.path.join(root, entry["base"]), [os.path.join(root, marker) for marker in entry["markers"]], os.path.join(root, entry["output"]), spreadsheet))
+    return submissions
+
+
+# only the batch as a whole is checked here, a submission with missing inputs fails its own collation
+def validate_submissions(submissions: list[Submission]):
+    if not submissions:
+        raise collator.CollationError("No submissions to collate!")
+
+    names = [submission.name for submission in submissions]
+    if len(names) != len(set(names)):
+        raise collator.CollationError("Submission names must be unique!")
+
+    outputs = [os.path.normpath(submission.output) for submission in submissions]
+    if len(outputs) != len(set(outputs)):
+        raise collator.CollationError("Submission output files must be unique!")
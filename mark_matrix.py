@@ -0,0 +1,131 @@
+import array
+
+import numpy
+
+
+# marks given by each author to each question, held as a dense question by author grid
+class MarkMatrix():
+
+    def __init__(self):
+        self._authors: list[str] = []
+        self._author_indexes: dict[str, int] = {}
+        self._question_ids: list[str] = []
+        self._question_indexes: dict[str, int] = {}
+
+        # marks are appended as (question, author, mark) entries and only gathered into a grid when read
+        self._entry_questions = array.array("q")
+        self._entry_authors = array.array("q")
+        self._entry_marks = array.array("d")
+        self._grid = None
+
+    @property
+    def authors(self) -> list[str]:
+        return self._authors
+
+    @property
+    def question_ids(self) -> list[str]:
+        return sorted(self._question_ids)
+
+    def add_author(self, author: str) -> int:
+        if author not in self._author_indexes:
+            self._author_indexes[author] = len(self._authors)
+            self._authors.append(author)
+            self._grid = None
+        return self._author_indexes[author]
+
+    def add_question(self, question_id: str) -> int:
+        if question_id not in self._question_indexes:
+            self._question_indexes[question_id] = len(self._question_ids)
+            self._question_ids.append(question_id)
+            self._grid = None
+        return self._question_indexes[question_id]
+
+    def add_mark(self, question_id: str, author: str, mark: float):
+        question_index = self.add_question(question_id)
+        author_index = self.add_author(author)
+        if mark is None:
+            return
+        self._entry_questions.append(question_index)
+        self._entry_authors.append(author_index)
+        self._entry_marks.append(mark)
+        self._grid = None
+
+    # matrix with the authors and questions of this matrix but only the marks of another, or the marks of both with those of the other taking precedence when keep_missing is set
+    def override(self, other: "MarkMatrix", keep_missing: bool = False) -> "MarkMatrix":
+        matrix = MarkMatrix()
+        for question_id in self._question_ids:
+            matrix.add_question(question_id)
+        for author in self._authors:
+            matrix.add_author(author)
+
+        marks: dict[tuple[str, str], float] = {}
+        other_grid = other.grid
+        other_questions = other.question_ids
+        for row in range(len(other_questions)):
+            if other_questions[row] not in matrix._question_indexes:
+                continue
+            for column in range(len(other.authors)):
+                if other.authors[column] in matrix._author_indexes and not numpy.isnan(other_grid[row, column]):
+                    marks[(other_questions[row], other.authors[column])] = float(other_grid[row, column])
+
+        if keep_missing:
+            for question_id, row in zip(self.question_ids, self.to_rows()):
+                for author, mark in zip(self._authors, row):
+                    if mark is not None:
+                        marks.setdefault((question_id, author), mark)
+
+        for (question_id, author), mark in marks.items():
+            matrix.add_mark(question_id, author, mark)
+        return matrix
+
+    # marks of another matrix given to a question or by an author this matrix does not have
+    def unmatched(self, other: "MarkMatrix") -> list[tuple[str, str]]:
+        unmatched: list[tuple[str, str]] = []
+        for question_id, row in zip(other.question_ids, other.to_rows()):
+            for author, mark in zip(other.authors, row):
+                if mark is not None and (question_id not in self._question_indexes or author not in self._author_indexes):
+                    unmatched.append((question_id, author))
+        return unmatched
+
+    # marks with a row per question in sorted order and a column per author, missing marks are NaN
+    @property
+    def grid(self) -> numpy.ndarray:
+        if self._grid is None:
+            order = sorted(range(len(self._question_ids)), key=self._question_ids.__getitem__)
+            rows = numpy.empty(len(order), dtype=numpy.int64)
+            rows[order] = numpy.arange(len(order))
+
+            grid = numpy.full((len(self._question_ids), len(self._authors)), numpy.nan)
+            questions = numpy.frombuffer(self._entry_questions, dtype=numpy.int64)
+            authors = numpy.frombuffer(self._entry_authors, dtype=numpy.int64)
+            grid[rows[questions], authors] = numpy.frombuffer(self._entry_marks, dtype=numpy.float64)
+            self._grid = grid
+        return self._grid
+
+    def counts(self) -> numpy.ndarray:
+        return numpy.count_nonzero(~numpy.isnan(self.grid), axis=1)
+
+    def means(self) -> numpy.ndarray:
+        counts = self.counts()
+        sums = numpy.nansum(self.grid, axis=1)
+        return numpy.divide(sums, counts, out=numpy.full(len(counts), numpy.nan), where=counts > 0)
+
+    def total(self) -> float:
+        return float(numpy.nansum(self.means()))
+
+    def to_rows(self) -> list[list[float]]:
+        return [[None if numpy.isnan(mark) else float(mark) for mark in row] for row in self.grid]
+
+    def to_dict(self) -> dict:
+        return {"authors": self.authors, "question_ids": self.question_ids, "marks": self.to_rows()}
+
+    @staticmethod
+    def from_dict(values: dict) -> "MarkMatrix":
+        matrix = MarkMatrix()
+        for author in values["authors"]:
+            matrix.add_author(author)
+        for row in range(len(values["question_ids"])):
+            matrix.add_question(values["question_ids"][row])
+            for column in range(len(values["authors"])):
+                matrix.add_mark(values["question_ids"][row], values["authors"][column], values["marks"][row][column])
+        return matrix
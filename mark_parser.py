@@ -0,0 +1,53 @@
+import re
+
+
+NUMBER = r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)"
+
+# patterns matching a single mark, each must capture a question and a mark group
+GRAMMARS = {
+    # "!# 3 4.5", anything after the mark is ignored
+    "simple": r"(?P<question>\S+)\s+(?P<mark>{0})".format(NUMBER),
+    # "!# Q3a 4.5", "!# 3a: 4.5/5" or several marks separated by semicolons "!# Q1 2; Q2 3.5/4", a Q is only dropped before a digit
+    "extended": r"(?:[Qq](?=[0-9]))?(?P<question>[0-9A-Za-z._-]+?)(?:\s*:\s*|\s+)(?P<mark>{0})(?:\s*/\s*{0})?".format(NUMBER),
+}
+
+# grammars which accept several marks in a single comment
+MULTIPLE_MARK_GRAMMARS = {"extended"}
+
+
+class MarkParser():
+
+    def __init__(self, comment_prefix_flag: str, grammar: str = "simple"):
+        self.comment_prefix_flag = comment_prefix_flag
+        self.grammar = grammar
+
+        # grammars which are not named are treated as a custom pattern for a single mark
+        pattern = GRAMMARS.get(grammar, grammar)
+        self._multiple = grammar in MULTIPLE_MARK_GRAMMARS
+        try:
+            if self._multiple:
+                self._pattern = re.compile(r"\s*(?:{})\s*(?:;|$)".format(pattern))
+            else:
+                self._pattern = re.compile(r"\s*(?:{})(?:\s.*)?$".format(pattern), re.DOTALL)
+        except re.error as error:
+            raise ValueError("Mark grammar \"{}\" is not a valid regular expression: {}".format(grammar, error))
+
+        if "question" not in self._pattern.groupindex or "mark" not in self._pattern.groupindex:
+            raise ValueError("Mark grammar \"{}\" must capture a question and a mark group!".format(grammar))
+
+    def is_mark(self, content: str) -> bool:
+        return content.lstrip().startswith(self.comment_prefix_flag)
+
+    # list of (question id, mark) pairs, raises ValueError when the comment does not follow the grammar
+    def parse(self, content: str) -> list[tuple[str, float]]:
+        body = content.strip()[len(self.comment_prefix_flag):]
+        marks: list[tuple[str, float]] = []
+        position = 0
+        while True:
+            match = self._pattern.match(body, position)
+            if match is None or match.end() == position:
+                raise ValueError("expected \"<question> <mark>\" at \"{}\"".format(body[position:].strip()))
+            marks.append((match.group("question"), float(match.group("mark"))))
+            position = match.end()
+            if not self._multiple or position >= len(body):
+                return marks
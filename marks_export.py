@@ -0,0 +1,144 @@
+import csv
+import importlib.util
+import json
+import os
+import sqlite3
+import typing
+
+import collator
+
+if typing.TYPE_CHECKING:
+    from mark_matrix import MarkMatrix
+
+
+# one record per mark given by a marker to a question of a submission
+COLUMNS = ["submission", "question_id", "marker", "alias", "mark", "source_file"]
+
+SQLITE_TABLE = "marks"
+
+LONG_FORMATS = {".csv": "csv", ".sqlite": "sqlite", ".db": "sqlite", ".parquet": "parquet"}
+
+
+def get_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".json":
+        return "json"
+    if extension not in LONG_FORMATS:
+        raise collator.CollationError("Unsupported marks export \"{}\", expected one of .json, {}!".format(path, ", ".join(LONG_FORMATS)))
+    return LONG_FORMATS[extension]
+
+
+def validate_path(path: str):
+
+    # checked without importing pyarrow so a missing optional package is reported before collating anything
+    if get_format(path) == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise collator.CollationError("Parquet marks files require the optional pyarrow package!")
+
+
+def result_records(name: str, result: collator.CollationResult) -> list[tuple]:
+    records: list[tuple] = []
+    for question_id, row in zip(result.matrix.question_ids, result.matrix.to_rows()):
+        for author, mark in zip(result.matrix.authors, row):
+            if mark is not None:
+                records.append((name, question_id, author, result.aliases.get(author), mark, result.sources.get((question_id, author))))
+    return records
+
+
+def export_marks(path: str, submissions: list, results: dict[str, collator.CollationResult]):
+    export_format = get_format(path)
+
+    # nested json keeps the submission details alongside its marks
+    if export_format == "json":
+        export = {"submissions": [dict(submission.to_dict(), aliases=results[submission.name].aliases, marks=results[submission.name].matrix.to_dict()) for submission in submissions]}
+        with collator.atomic_output(path) as temp_path, open(temp_path, "w") as file:
+            json.dump(export, file, indent=2)
+        return
+
+    records = [record for submission in submissions for record in result_records(submission.name, results[submission.name])]
+    if export_format == "csv":
+        write_csv(path, records)
+    elif export_format == "sqlite":
+        write_sqlite(path, records)
+    else:
+        write_parquet(path, records)
+
+
+def write_csv(path: str, records: list[tuple]):
+    with collator.atomic_output(path) as temp_path, open(temp_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        writer.writerows(records)
+
+
+def write_sqlite(path: str, records: list[tuple]):
+
+    # the table is replaced in a single transaction so readers never see a partial export
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            connection.execute("DROP TABLE IF EXISTS {}".format(SQLITE_TABLE))
+            connection.execute("CREATE TABLE {} (submission TEXT NOT NULL, question_id TEXT NOT NULL, marker TEXT NOT NULL, alias TEXT, mark REAL, source_file TEXT)".format(SQLITE_TABLE))
+            connection.executemany("INSERT INTO {} VALUES (?, ?, ?, ?, ?, ?)".format(SQLITE_TABLE), records)
+    finally:
+        connection.close()
+
+
+def write_parquet(path: str, records: list[tuple]):
+    pyarrow, parquet = import_pyarrow()
+    columns = list(zip(*records)) if records else [()] * len(COLUMNS)
+    types = [pyarrow.string(), pyarrow.string(), pyarrow.string(), pyarrow.string(), pyarrow.float64(), pyarrow.string()]
+    table = pyarrow.table([pyarrow.array(column, type=column_type) for column, column_type in zip(columns, types)], names=COLUMNS)
+    with collator.atomic_output(path) as temp_path:
+        parquet.write_table(table, temp_path)
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise collator.CollationError("Parquet marks files require the optional pyarrow package!")
+    return pyarrow, pyarrow.parquet
+
+
+def read_records(path: str) -> list[tuple]:
+    export_format = get_format(path)
+    if export_format == "json":
+        raise collator.CollationError("Overriding marks must be read from a .csv, .sqlite, .db or .parquet file!")
+
+    if export_format == "csv":
+        with open(path, "r", newline="") as file:
+            reader = csv.DictReader(file)
+            missing = [column for column in ("submission", "question_id", "marker", "mark") if column not in (reader.fieldnames or [])]
+            if missing:
+                raise collator.CollationError("Marks file \"{}\" is missing columns {}!".format(path, ", ".join(missing)))
+            return [(row["submission"], row["question_id"], row["marker"], float(row["mark"]) if row["mark"] else None) for row in reader]
+
+    if export_format == "sqlite":
+        connection = sqlite3.connect(path)
+        try:
+            return connection.execute("SELECT submission, question_id, marker, mark FROM {}".format(SQLITE_TABLE)).fetchall()
+        except sqlite3.Error as error:
+            raise collator.CollationError("Unable to read marks from \"{}\": {}".format(path, error))
+        finally:
+            connection.close()
+
+    _, parquet = import_pyarrow()
+    table = parquet.read_table(path, columns=["submission", "question_id", "marker", "mark"])
+    return list(zip(*(table.column(column).to_pylist() for column in table.column_names)))
+
+
+def read_overrides(path: str, names: list[str]) -> dict[str, "MarkMatrix"]:
+    from mark_matrix import MarkMatrix
+
+    try:
+        records = read_records(path)
+    except (OSError, ValueError, csv.Error) as error:
+        raise collator.CollationError("Unable to read marks from \"{}\": {}".format(path, error))
+
+    # marks are grouped into a matrix per submission, submissions not being collated are ignored and submissions without records keep their extracted marks
+    overriding_marks: dict[str, MarkMatrix] = {name: MarkMatrix() for name in names}
+    for submission, question_id, marker, mark in records:
+        if submission in overriding_marks:
+            overriding_marks[submission].add_mark(str(question_id), marker, mark)
+    return overriding_marks
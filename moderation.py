@@ -0,0 +1,118 @@
+import csv
+import logging
+
+import numpy
+
+import collator
+
+
+# marker agreement across a cohort, computed over every mark at once rather than per submission
+class CohortStatistics():
+
+    def __init__(self, names: list[str], results: dict[str, collator.CollationResult]):
+        self.groups: list[tuple[str, str]] = []
+        self.markers: list[str] = []
+        marker_indexes: dict[str, int] = {}
+
+        # flatten every submission's grid into one mark per entry, grouped by submission and question
+        group_parts, marker_parts, mark_parts = [], [], []
+        for name in names:
+            matrix = results[name].matrix
+            grid = matrix.grid
+            rows, columns = numpy.nonzero(~numpy.isnan(grid))
+            for author in matrix.authors:
+                marker_indexes.setdefault(author, len(marker_indexes))
+            author_indexes = numpy.array([marker_indexes[author] for author in matrix.authors], dtype=numpy.int64)
+
+            group_parts.append(rows + len(self.groups))
+            marker_parts.append(author_indexes[columns])
+            mark_parts.append(grid[rows, columns])
+            self.groups.extend((name, question_id) for question_id in matrix.question_ids)
+        self.markers = list(marker_indexes)
+
+        self.entry_groups = numpy.concatenate(group_parts) if group_parts else numpy.empty(0, dtype=numpy.int64)
+        self.entry_markers = numpy.concatenate(marker_parts) if marker_parts else numpy.empty(0, dtype=numpy.int64)
+        self.entry_marks = numpy.concatenate(mark_parts) if mark_parts else numpy.empty(0)
+
+        group_count = len(self.groups)
+        self.counts = numpy.bincount(self.entry_groups, minlength=group_count)
+        sums = numpy.bincount(self.entry_groups, weights=self.entry_marks, minlength=group_count)
+
+        marked = self.counts > 0
+        self.means = numpy.full(group_count, numpy.nan)
+        self.means[marked] = sums[marked] / self.counts[marked]
+
+        # variance from residuals about the mean rather than the mean of squares, which cancels badly
+        residuals = self.entry_marks - self.means[self.entry_groups]
+        squared_residuals = numpy.bincount(self.entry_groups, weights=residuals ** 2, minlength=group_count)
+        self.variances = numpy.full(group_count, numpy.nan)
+        self.variances[marked] = squared_residuals[marked] / self.counts[marked]
+
+        maximums = numpy.full(group_count, -numpy.inf)
+        minimums = numpy.full(group_count, numpy.inf)
+        numpy.maximum.at(maximums, self.entry_groups, self.entry_marks)
+        numpy.minimum.at(minimums, self.entry_groups, self.entry_marks)
+        self.spreads = numpy.where(marked, maximums - minimums, numpy.nan)
+
+        deviations = numpy.zeros(group_count)
+        numpy.maximum.at(deviations, self.entry_groups, numpy.abs(residuals))
+        self.max_deviations = numpy.where(marked, deviations, numpy.nan)
+
+        # entries ordered by group so the marks of any one question can be sliced out
+        self._entry_order = numpy.argsort(self.entry_groups, kind="stable")
+        self._group_starts = numpy.cumsum(self.counts) - self.counts
+
+        # bias of each marker from the mean mark of questions they marked alongside others, questions marked once are ignored
+        compared = self.counts[self.entry_groups] > 1
+        self.marker_counts = numpy.bincount(self.entry_markers[compared], minlength=len(self.markers))
+        bias_sums = numpy.bincount(self.entry_markers[compared], weights=residuals[compared], minlength=len(self.markers))
+        absolute_sums = numpy.bincount(self.entry_markers[compared], weights=numpy.abs(residuals[compared]), minlength=len(self.markers))
+        self.marker_bias = numpy.full(len(self.markers), numpy.nan)
+        self.marker_mean_deviation = numpy.full(len(self.markers), numpy.nan)
+        has_compared = self.marker_counts > 0
+        self.marker_bias[has_compared] = bias_sums[has_compared] / self.marker_counts[has_compared]
+        self.marker_mean_deviation[has_compared] = absolute_sums[has_compared] / self.marker_counts[has_compared]
+
+    # indexes of questions marked more than once with a spread above the threshold, most disagreement first
+    def needs_moderation(self, threshold: float) -> numpy.ndarray:
+        candidates = numpy.nonzero((self.counts > 1) & (self.spreads > threshold))[0]
+        order = numpy.lexsort((-self.variances[candidates], -self.spreads[candidates]))
+        return candidates[order]
+
+    # indexes of markers with compared marks, largest absolute bias first
+    def ranked_markers(self) -> numpy.ndarray:
+        candidates = numpy.nonzero(self.marker_counts > 0)[0]
+        return candidates[numpy.argsort(-numpy.abs(self.marker_bias[candidates]), kind="stable")]
+
+    def group_marks(self, group: int) -> str:
+        entries = self._entry_order[self._group_starts[group]:self._group_starts[group] + self.counts[group]]
+        return "; ".join("{}: {:g}".format(self.markers[self.entry_markers[entry]], self.entry_marks[entry]) for entry in entries)
+
+
+def write_moderation_report(path: str, statistics: CohortStatistics, threshold: float):
+    ranked = statistics.needs_moderation(threshold)
+    with collator.atomic_output(path) as temp_path, open(temp_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["rank", "submission", "question_id", "markers", "mean", "spread", "variance", "max_deviation", "marks"])
+        for rank, group in enumerate(ranked, start=1):
+            submission, question_id = statistics.groups[group]
+            writer.writerow([rank, submission, question_id, statistics.counts[group], round(statistics.means[group], 4), statistics.spreads[group], round(statistics.variances[group], 4), round(statistics.max_deviations[group], 4), statistics.group_marks(group)])
+
+
+def write_marker_report(path: str, statistics: CohortStatistics):
+    with collator.atomic_output(path) as temp_path, open(temp_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["marker", "compared_marks", "bias", "mean_absolute_deviation"])
+        for marker in statistics.ranked_markers():
+            writer.writerow([statistics.markers[marker], statistics.marker_counts[marker], round(statistics.marker_bias[marker], 4), round(statistics.marker_mean_deviation[marker], 4)])
+
+
+def log_summary(statistics: CohortStatistics, threshold: float, limit: int = 10):
+    ranked = statistics.needs_moderation(threshold)
+    logging.info("{} of {} questions need moderation.".format(len(ranked), int(numpy.count_nonzero(statistics.counts > 1))))
+    for group in ranked[:limit]:
+        submission, question_id = statistics.groups[group]
+        logging.info("  {} Q: {}, spread {:g} ({})".format(submission, question_id, statistics.spreads[group], statistics.group_marks(group)))
+
+    for marker in statistics.ranked_markers()[:limit]:
+        logging.info("  {} bias {:+.2f} over {} compared marks".format(statistics.markers[marker], statistics.marker_bias[marker], statistics.marker_counts[marker]))
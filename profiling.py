@@ -0,0 +1,86 @@
+import contextlib
+import logging
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss() -> float:
+
+    # high-water mark of the resident set size of this process in megabytes, it never decreases, unavailable on windows
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+# peak_rss_mb is the process high-water mark when a stage finished, so it includes every earlier stage,
+# rss_growth_mb is the most a single call of the stage raised that high-water mark
+def new_record() -> dict:
+    return {"seconds": 0.0, "peak_rss_mb": None, "rss_growth_mb": None}
+
+
+def add_record(record: dict, seconds: float, rss: float = None, growth: float = None):
+    record["seconds"] += seconds
+    if rss is not None and (record["peak_rss_mb"] is None or rss > record["peak_rss_mb"]):
+        record["peak_rss_mb"] = rss
+    if growth is not None and (record["rss_growth_mb"] is None or growth > record["rss_growth_mb"]):
+        record["rss_growth_mb"] = growth
+
+
+class Profiler():
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages: dict[str, dict] = {}
+        self.files: dict[str, dict[str, dict]] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str, file: str = None):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        start_rss = peak_rss()
+        try:
+            yield
+        finally:
+            rss = peak_rss()
+            self.record(name, time.perf_counter() - start, rss, rss - start_rss if rss is not None else None, file)
+
+    def record(self, name: str, seconds: float, rss: float = None, growth: float = None, file: str = None, calls: int = 1):
+        stage = self.stages.setdefault(name, dict(new_record(), calls=0))
+        stage["calls"] += calls
+        add_record(stage, seconds, rss, growth)
+
+        if file is not None:
+            self.record_file(file, name, seconds, rss, growth)
+
+    def record_file(self, file: str, name: str, seconds: float, rss: float = None, growth: float = None):
+        add_record(self.files.setdefault(file, {}).setdefault(name, new_record()), seconds, rss, growth)
+
+    def merge(self, other: "Profiler"):
+        if other is None:
+            return
+        for name, stage in other.stages.items():
+            self.record(name, stage["seconds"], stage["peak_rss_mb"], stage["rss_growth_mb"], calls=stage["calls"])
+        for file, file_stages in other.files.items():
+            for name, record in file_stages.items():
+                self.record_file(file, name, record["seconds"], record["peak_rss_mb"], record["rss_growth_mb"])
+
+    def to_dict(self) -> dict:
+        return {"stages": self.stages, "files": self.files}
+
+    def log_summary(self):
+        logging.info("{:<28} {:>8} {:>12} {:>12} {:>14} {:>16}".format("Stage", "Calls", "Total (s)", "Mean (s)", "Max RSS (MB)", "RSS Growth (MB)"))
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[1]["seconds"], reverse=True):
+            rss = "-" if stage["peak_rss_mb"] is None else "{:.1f}".format(stage["peak_rss_mb"])
+            growth = "-" if stage["rss_growth_mb"] is None else "{:.1f}".format(stage["rss_growth_mb"])
+            logging.info("{:<28} {:>8} {:>12.4f} {:>12.4f} {:>14} {:>16}".format(name, stage["calls"], stage["seconds"], stage["seconds"] / stage["calls"], rss, growth))
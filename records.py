@@ -0,0 +1,68 @@
+# records passed between processes and stored in the extraction cache and build state, kept out of the collator
+# script so they pickle under the same module name however the collator is run
+
+import typing
+
+from profiling import Profiler
+
+# numpy is slow to import so mark matrices are only imported when results are read back
+if typing.TYPE_CHECKING:
+    from mark_matrix import MarkMatrix
+
+
+class MarkComment():
+    __slots__ = ("author", "question_id", "mark")
+
+    def __init__(self, author: str = None, question_id: str = None, mark: float = None):
+        self.author = author
+        self.question_id = question_id
+        self.mark = mark
+
+    def __str__(self):
+        return "Question: {}, Mark: {}, Author: {}".format(self.question_id, self.mark, self.author)
+
+
+class FeedbackComment():
+    __slots__ = ("author", "text", "page", "flags", "rect", "type")
+
+    def __init__(self, raw_annotation):
+        self.author: str = None
+        self.text: str = None
+        self.page: int = None
+        self.flags = None
+        self.rect = None
+        self.type = None
+
+        if raw_annotation is None:
+            return
+
+        self.author = raw_annotation.info["title"].strip()
+        self.text = raw_annotation.info["content"].strip()
+        self.page = raw_annotation.parent.number
+        self.rect = (raw_annotation.rect[0], raw_annotation.rect[1], raw_annotation.rect[2], raw_annotation.rect[3])
+        self.flags = raw_annotation.flags
+        self.type = raw_annotation.type[1]
+
+
+class CollationResult():
+    output_path: str = None
+    aliases: dict[str, str] = None
+    matrix: "MarkMatrix" = None
+    sources: dict[tuple[str, str], str] = None
+    profile: Profiler = None
+
+    def __init__(self, output_path: str, aliases: dict[str, str], matrix: "MarkMatrix", sources: dict[tuple[str, str], str] = None):
+        self.output_path = output_path
+        self.aliases = aliases
+        self.matrix = matrix
+
+        # marked pdf each (question id, author) mark was extracted from
+        self.sources = sources if sources is not None else {}
+
+    def to_dict(self) -> dict:
+        return {"output_path": self.output_path, "aliases": self.aliases, "matrix": self.matrix.to_dict(), "sources": [[question_id, author, source] for (question_id, author), source in self.sources.items()]}
+
+    @staticmethod
+    def from_dict(values: dict):
+        from mark_matrix import MarkMatrix
+        return CollationResult(values["output_path"], values["aliases"], MarkMatrix.from_dict(values["matrix"]), {(question_id, author): source for question_id, author, source in values["sources"]})
@@ -0,0 +1,138 @@
+import json
+import os
+
+import pytest
+
+import bulk_collator
+import collator
+import manifest
+from mark_matrix import MarkMatrix
+
+
+def entry(name: str) -> dict:
+    return {"submission": name, "fingerprint": name, "failed": False, "result": None}
+
+
+def test_replay_journal_ignores_torn_line(tmp_path):
+    path = os.path.join(tmp_path, bulk_collator.JOURNAL_FILE)
+    with open(path, "w") as file:
+        bulk_collator.append_journal(file, "a.pdf", entry("a"))
+        bulk_collator.append_journal(file, "b.pdf", entry("b"))
+        file.write(json.dumps({"version": bulk_collator.STATE_VERSION, "output": "c.pdf", "entry": entry("c")})[:20])
+
+    state = {"version": bulk_collator.STATE_VERSION, "submissions": {"a.pdf": entry("old")}, "files": {}}
+    bulk_collator.replay_journal(path, state)
+    assert state["submissions"] == {"a.pdf": entry("a"), "b.pdf": entry("b")}
+
+
+def test_replay_journal_ignores_other_versions(tmp_path):
+    path = os.path.join(tmp_path, bulk_collator.JOURNAL_FILE)
+    with open(path, "w") as file:
+        file.write(json.dumps({"version": bulk_collator.STATE_VERSION - 1, "output": "a.pdf", "entry": entry("a")}) + "\n")
+
+    state = {"version": bulk_collator.STATE_VERSION, "submissions": {}, "files": {}}
+    bulk_collator.replay_journal(path, state)
+    assert state["submissions"] == {}
+
+
+def test_replay_missing_journal(tmp_path):
+    state = {"version": bulk_collator.STATE_VERSION, "submissions": {}, "files": {}}
+    bulk_collator.replay_journal(os.path.join(tmp_path, bulk_collator.JOURNAL_FILE), state)
+    assert state["submissions"] == {}
+
+
+def make_submission(root) -> tuple:
+    for name in ["base.pdf", "marker.pdf"]:
+        with open(os.path.join(root, name), "wb") as file:
+            file.write(name.encode())
+    args = bulk_collator.get_arguments([str(root)])
+    submission = manifest.Submission("ada", os.path.join(root, "base.pdf"), [os.path.join(root, "marker.pdf")], os.path.join(root, "output.pdf"))
+    return args, bulk_collator.get_submission_args(bulk_collator.get_collation_args(args), submission)
+
+
+def test_fingerprint_changes_with_inputs_and_options(tmp_path):
+    args, collation_args = make_submission(tmp_path)
+    fingerprint = bulk_collator.fingerprint_submission(args, collation_args, {})
+    assert bulk_collator.fingerprint_submission(args, collation_args, {}) == fingerprint
+
+    collation_args.alias_authors = False
+    assert bulk_collator.fingerprint_submission(args, collation_args, {}) != fingerprint
+    collation_args.alias_authors = True
+
+    with open(os.path.join(tmp_path, "marker.pdf"), "wb") as file:
+        file.write(b"changed")
+    assert bulk_collator.fingerprint_submission(args, collation_args, {}) != fingerprint
+
+
+def test_hash_input_reuses_unchanged_files(tmp_path):
+    path = os.path.join(tmp_path, "a.pdf")
+    with open(path, "wb") as file:
+        file.write(b"one")
+    file_hashes = {}
+    digest = bulk_collator.hash_input(path, file_hashes)
+
+    # a stale hash is trusted while the size and modification time are unchanged
+    file_hashes[os.path.abspath(path)][2] = "cached"
+    assert bulk_collator.hash_input(path, file_hashes) == "cached"
+
+    os.utime(path, ns=(0, 0))
+    assert bulk_collator.hash_input(path, file_hashes) == digest
+    assert bulk_collator.hash_input(os.path.join(tmp_path, "missing.pdf"), file_hashes) == "missing"
+
+
+def test_is_up_to_date(tmp_path):
+    args, collation_args = make_submission(tmp_path)
+    state_entry = {"submission": "ada", "fingerprint": "abc", "failed": False, "result": {}}
+    assert not bulk_collator.is_up_to_date(args, collation_args, state_entry, "abc")
+
+    with open(collation_args.output_file, "wb") as file:
+        file.write(b"output")
+    assert bulk_collator.is_up_to_date(args, collation_args, state_entry, "abc")
+    assert not bulk_collator.is_up_to_date(args, collation_args, state_entry, "def")
+    assert not bulk_collator.is_up_to_date(args, collation_args, None, "abc")
+    assert not bulk_collator.is_up_to_date(args, collation_args, dict(state_entry, fingerprint=None), None)
+
+    # failed collations are retried, except while watching
+    assert not bulk_collator.is_up_to_date(args, collation_args, dict(state_entry, failed=True), "abc")
+    args.watch = True
+    assert bulk_collator.is_up_to_date(args, collation_args, dict(state_entry, failed=True), "abc")
+
+
+def make_result(marks: dict) -> collator.CollationResult:
+    matrix = MarkMatrix()
+    for (question_id, author), mark in marks.items():
+        matrix.add_mark(question_id, author, mark)
+    return collator.CollationResult("output.pdf", {author: "Marker #{}".format(index + 1) for index, author in enumerate(matrix.authors)}, matrix)
+
+
+def test_combined_spreadsheet_round_trip(tmp_path):
+    names = [os.path.join(tmp_path, "ada"), os.path.join(tmp_path, "boltzmann")]
+    results = {
+        names[0]: make_result({("1", "Alice"): 2.0, ("1", "Bob"): 3.0, ("2", "Alice"): 4.0}),
+        names[1]: make_result({("1", "Bob"): 1.5, ("2", "Carol"): 5.0}),
+    }
+    args = bulk_collator.get_arguments(names)
+    bulk_collator.generate_combined_spreadsheet(args, names, results)
+
+    overriding_marks = bulk_collator.use_combined_spreadsheet(args, names)
+    assert {name: overriding_marks[name].to_dict() for name in names} == {name: results[name].matrix.to_dict() for name in names}
+
+    # blocks are matched by directory name when the sheet was generated with other paths
+    relative_names = [os.path.relpath(name) for name in names]
+    overriding_marks = bulk_collator.use_combined_spreadsheet(bulk_collator.get_arguments(relative_names), relative_names)
+    assert overriding_marks[relative_names[1]].to_dict() == results[names[1]].matrix.to_dict()
+
+
+def test_match_spreadsheet_blocks():
+    ada, boltzmann = MarkMatrix(), MarkMatrix()
+
+    # labels written on windows match either separator
+    blocks = [("examples\\bulk\\ada", ada), ("examples\\bulk\\boltzmann", boltzmann)]
+    assert bulk_collator.match_spreadsheet_blocks(["examples/bulk/boltzmann", "examples/bulk/ada"], blocks) == {"examples/bulk/boltzmann": boltzmann, "examples/bulk/ada": ada}
+
+    # then by directory name, then in order
+    assert bulk_collator.match_spreadsheet_blocks(["/marking/ada"], blocks) == {"/marking/ada": ada}
+    assert bulk_collator.match_spreadsheet_blocks(["first", "second"], blocks) == {"first": ada, "second": boltzmann}
+
+    with pytest.raises(collator.CollationError):
+        bulk_collator.match_spreadsheet_blocks(["curie"], blocks)
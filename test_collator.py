@@ -0,0 +1,41 @@
+import collator
+
+
+def comment(text: str, rect: tuple, page: int = 0, annotation_type: str = "Text", author: str = "Alice") -> collator.FeedbackComment:
+    feedback = collator.FeedbackComment(None)
+    feedback.author = author
+    feedback.text = text
+    feedback.page = page
+    feedback.rect = rect
+    feedback.type = annotation_type
+    return feedback
+
+
+def test_comment_index_drops_exact_duplicates():
+    index = collator.CommentIndex()
+    assert index.add(comment("Good", (10.0, 10.0, 20.0, 20.0)))
+    assert not index.add(comment("Good", (10.02, 10.0, 20.0, 20.0), author="Bob"))
+    assert index.add(comment("Good", (10.0, 10.0, 20.0, 20.0), page=1))
+    assert index.add(comment("Good", (10.0, 10.0, 20.0, 20.0), annotation_type="Highlight"))
+    assert index.add(comment("Better", (10.0, 10.0, 20.0, 20.0)))
+    assert index.duplicates == 1
+    assert index.near_duplicates == 0
+
+
+def test_comment_index_coalesces_near_duplicates():
+    index = collator.CommentIndex(tolerance=2.0)
+    assert index.add(comment("Good", (10.0, 10.0, 20.0, 20.0)))
+    assert not index.add(comment("Good", (11.5, 9.0, 21.0, 20.0)))
+    assert index.add(comment("Good", (13.0, 10.0, 23.0, 20.0)))
+    assert index.duplicates == 0
+    assert index.near_duplicates == 1
+
+
+def test_comment_index_copy_is_independent():
+    base = collator.CommentIndex()
+    base.add(comment("Template", (0.0, 0.0, 5.0, 5.0)))
+
+    index = base.copy(tolerance=1.0)
+    assert not index.add(comment("Template", (0.5, 0.0, 5.0, 5.0)))
+    assert index.add(comment("New", (0.0, 0.0, 5.0, 5.0)))
+    assert base.add(comment("New", (0.0, 0.0, 5.0, 5.0)))
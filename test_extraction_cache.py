@@ -0,0 +1,56 @@
+import os
+import time
+
+import extraction_cache
+
+
+def write_entry(cache_dir, key: str, size: int, age: float):
+    extraction_cache.store_entry(cache_dir, key, b"x" * size)
+    modified_time = time.time() - age
+    os.utime(os.path.join(cache_dir, key + extraction_cache.ENTRY_SUFFIX), (modified_time, modified_time))
+
+
+def entries(cache_dir) -> list[str]:
+    return sorted(name.removesuffix(extraction_cache.ENTRY_SUFFIX) for name in os.listdir(cache_dir))
+
+
+def test_store_and_load_entry(tmp_path):
+    extraction_cache.store_entry(tmp_path, "key", ([1], [2], []))
+    assert extraction_cache.load_entry(tmp_path, "key") == ([1], [2], [])
+    assert extraction_cache.load_entry(tmp_path, "missing") is None
+
+
+def test_cache_key_depends_on_content_and_options(tmp_path):
+    path = os.path.join(tmp_path, "a.pdf")
+    with open(path, "wb") as file:
+        file.write(b"one")
+    key = extraction_cache.cache_key(path, "!#", "simple")
+    assert extraction_cache.cache_key(path, "!#", "simple") == key
+    assert extraction_cache.cache_key(path, "!#", "extended") != key
+
+    with open(path, "wb") as file:
+        file.write(b"two")
+    assert extraction_cache.cache_key(path, "!#", "simple") != key
+
+
+def test_evict_expired_entries(tmp_path):
+    write_entry(tmp_path, "old", 10, 100)
+    write_entry(tmp_path, "new", 10, 0)
+    extraction_cache.evict_entries(tmp_path, 1024 * 1024, 50)
+    assert entries(tmp_path) == ["new"]
+
+
+def test_evict_least_recently_used_over_size(tmp_path):
+    write_entry(tmp_path, "oldest", 1000, 30)
+    write_entry(tmp_path, "older", 1000, 20)
+    write_entry(tmp_path, "newest", 1000, 10)
+    extraction_cache.evict_entries(tmp_path, 2500, 3600)
+    assert entries(tmp_path) == ["newest", "older"]
+
+
+def test_loading_refreshes_entry(tmp_path):
+    write_entry(tmp_path, "used", 1000, 30)
+    write_entry(tmp_path, "unused", 1000, 20)
+    extraction_cache.load_entry(tmp_path, "used")
+    extraction_cache.evict_entries(tmp_path, 1500, 3600)
+    assert entries(tmp_path) == ["used"]
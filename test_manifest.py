@@ -0,0 +1,52 @@
+import json
+import os
+
+import pytest
+
+import collator
+import manifest
+
+
+def write_inputs(root, names: list[str]):
+    for name in names:
+        os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+        open(os.path.join(root, name), "wb").close()
+
+
+def test_load_csv_manifest(tmp_path):
+    write_inputs(tmp_path, ["template.pdf", "ada/marker1.pdf", "ada/marker2.pdf"])
+    path = os.path.join(tmp_path, "submissions.csv")
+    with open(path, "w") as file:
+        file.write("submission,base,markers,output\n")
+        file.write("ada,template.pdf,ada/marker1.pdf; ada/marker2.pdf,collated/ada.pdf\n")
+
+    submissions = manifest.load_manifest(path)
+    manifest.validate_submissions(submissions)
+    assert [submission.name for submission in submissions] == ["ada"]
+    assert submissions[0].base == os.path.join(tmp_path, "template.pdf")
+    assert submissions[0].markers == [os.path.join(tmp_path, "ada/marker1.pdf"), os.path.join(tmp_path, "ada/marker2.pdf")]
+    assert submissions[0].spreadsheet == os.path.join(tmp_path, "collated/ada.xlsx")
+
+
+def test_load_json_manifest_missing_field(tmp_path):
+    path = os.path.join(tmp_path, "submissions.json")
+    with open(path, "w") as file:
+        json.dump([{"submission": "ada", "base": "template.pdf", "markers": []}], file)
+
+    with pytest.raises(collator.CollationError):
+        manifest.load_manifest(path)
+
+
+def test_validate_submissions(tmp_path):
+    ada = manifest.Submission("ada", os.path.join(tmp_path, "template.pdf"), [os.path.join(tmp_path, "missing.pdf")], os.path.join(tmp_path, "ada.pdf"))
+    boltzmann = manifest.Submission("boltzmann", os.path.join(tmp_path, "template.pdf"), [], os.path.join(tmp_path, "ada.pdf"))
+
+    # missing inputs are left for the collation of that submission to report
+    manifest.validate_submissions([ada])
+
+    with pytest.raises(collator.CollationError, match="names"):
+        manifest.validate_submissions([ada, ada])
+    with pytest.raises(collator.CollationError, match="output"):
+        manifest.validate_submissions([ada, boltzmann])
+    with pytest.raises(collator.CollationError):
+        manifest.validate_submissions([])
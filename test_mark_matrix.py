@@ -0,0 +1,65 @@
+import math
+
+from mark_matrix import MarkMatrix
+
+
+def make_matrix() -> MarkMatrix:
+    matrix = MarkMatrix()
+    matrix.add_mark("2", "Alice", 3.0)
+    matrix.add_mark("1", "Alice", 2.0)
+    matrix.add_mark("1", "Bob", 4.0)
+    matrix.add_author("Carol")
+    matrix.add_mark("3", "Bob", None)
+    return matrix
+
+
+def test_grid_is_sorted_by_question():
+    matrix = make_matrix()
+    assert matrix.question_ids == ["1", "2", "3"]
+    assert matrix.authors == ["Alice", "Bob", "Carol"]
+    assert matrix.to_rows() == [[2.0, 4.0, None], [3.0, None, None], [None, None, None]]
+
+
+def test_means_and_total():
+    matrix = make_matrix()
+    means = matrix.means()
+    assert means[0] == 3.0
+    assert means[1] == 3.0
+    assert math.isnan(means[2])
+    assert matrix.total() == 6.0
+
+
+def test_override_keeps_questions_and_authors():
+    other = MarkMatrix()
+    other.add_mark("1", "Alice", 5.0)
+    other.add_mark("2", "Bob", 1.0)
+    other.add_mark("4", "Alice", 9.0)
+    other.add_mark("1", "Dave", 9.0)
+
+    matrix = make_matrix().override(other)
+    assert matrix.question_ids == ["1", "2", "3"]
+    assert matrix.authors == ["Alice", "Bob", "Carol"]
+    assert matrix.to_rows() == [[5.0, None, None], [None, 1.0, None], [None, None, None]]
+
+
+def test_dict_round_trip():
+    matrix = make_matrix()
+    assert MarkMatrix.from_dict(matrix.to_dict()).to_dict() == matrix.to_dict()
+
+
+def test_override_keep_missing():
+    other = MarkMatrix()
+    other.add_mark("1", "Alice", 5.0)
+    other.add_mark("3", "Carol", 1.0)
+
+    matrix = make_matrix().override(other, keep_missing=True)
+    assert matrix.to_rows() == [[5.0, 4.0, None], [3.0, None, None], [None, None, 1.0]]
+
+
+def test_unmatched():
+    other = MarkMatrix()
+    other.add_mark("1", "Alice", 5.0)
+    other.add_mark("4", "Alice", 9.0)
+    other.add_mark("1", "Dave", 9.0)
+    other.add_mark("2", "Dave", None)
+    assert make_matrix().unmatched(other) == [("1", "Dave"), ("4", "Alice")]
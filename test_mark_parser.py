@@ -0,0 +1,42 @@
+import pytest
+
+from mark_parser import MarkParser
+
+
+def test_simple_grammar():
+    parser = MarkParser("!#")
+    assert parser.is_mark("  !# 3 4.5")
+    assert not parser.is_mark("Good work")
+    assert parser.parse("!# 3 4.5") == [("3", 4.5)]
+    assert parser.parse("!# 2a -1 lost a mark for units") == [("2a", -1.0)]
+
+
+def test_simple_grammar_rejects_missing_mark():
+    with pytest.raises(ValueError):
+        MarkParser("!#").parse("!# 3")
+
+
+def test_extended_grammar():
+    parser = MarkParser("!#", "extended")
+    assert parser.parse("!# Q3a 4.5") == [("3a", 4.5)]
+    assert parser.parse("!# 3a: 4.5/5") == [("3a", 4.5)]
+    assert parser.parse("!# Q1 2; Q2 3.5/4") == [("1", 2.0), ("2", 3.5)]
+    assert parser.parse("!# quality 4") == [("quality", 4.0)]
+    assert parser.parse("!# Qa: 1") == [("Qa", 1.0)]
+
+
+def test_extended_grammar_rejects_trailing_text():
+    with pytest.raises(ValueError):
+        MarkParser("!#", "extended").parse("!# Q1 2; nonsense")
+
+
+def test_custom_grammar():
+    parser = MarkParser("MARK", r"(?P<mark>\d+) for (?P<question>\w+)")
+    assert parser.parse("MARK 7 for q2") == [("q2", 7.0)]
+
+
+def test_custom_grammar_requires_groups():
+    with pytest.raises(ValueError):
+        MarkParser("!#", r"(?P<question>\S+)")
+    with pytest.raises(ValueError):
+        MarkParser("!#", r"(?P<question>")
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import collator
+import manifest
+import marks_export
+from mark_matrix import MarkMatrix
+
+
+def make_result(name: str) -> collator.CollationResult:
+    matrix = MarkMatrix()
+    matrix.add_mark("1", "Alice", 2.0)
+    matrix.add_mark("1", "Bob", 4.0)
+    matrix.add_mark("2", "Alice", 3.5)
+    sources = {("1", "Alice"): "{}/alice.pdf".format(name), ("1", "Bob"): "{}/bob.pdf".format(name), ("2", "Alice"): "{}/alice.pdf".format(name)}
+    return collator.CollationResult("{}/output.pdf".format(name), {"Alice": "Marker 1", "Bob": "Marker 2"}, matrix, sources)
+
+
+@pytest.mark.parametrize("extension", [".csv", ".sqlite"])
+def test_export_round_trip(tmp_path, extension):
+    submissions = [manifest.Submission(name, "{}/base.pdf".format(name), [], "{}/output.pdf".format(name)) for name in ("ada", "curie")]
+    results = {submission.name: make_result(submission.name) for submission in submissions}
+    path = os.path.join(tmp_path, "marks" + extension)
+    marks_export.export_marks(path, submissions, results)
+
+    assert marks_export.read_records(path)[0] == ("ada", "1", "Alice", 2.0)
+
+    # submissions not being collated are ignored
+    overriding_marks = marks_export.read_overrides(path, ["curie"])
+    assert list(overriding_marks) == ["curie"]
+    assert overriding_marks["curie"].to_dict() == results["curie"].matrix.to_dict()
+
+
+def test_partial_override(tmp_path):
+    path = os.path.join(tmp_path, "marks.csv")
+    with open(path, "w") as file:
+        file.write("submission,question_id,marker,mark\n")
+        file.write("ada,1,Bob,5\n")
+        file.write("ada,3,Bob,1\n")
+
+    overriding_marks = marks_export.read_overrides(path, ["ada", "curie"])
+    assert not overriding_marks["curie"].authors
+
+    # extracted marks without a record are kept and records matching nothing extracted are ignored
+    extracted = make_result("ada").matrix
+    assert extracted.override(overriding_marks["ada"], keep_missing=True).to_rows() == [[2.0, 5.0], [3.5, None]]
+    assert extracted.unmatched(overriding_marks["ada"]) == [("3", "Bob")]
+
+
+def test_read_json_overrides(tmp_path):
+    with pytest.raises(collator.CollationError):
+        marks_export.read_overrides(os.path.join(tmp_path, "marks.json"), ["ada"])
@@ -0,0 +1,55 @@
+import pytest
+
+import collator
+import moderation
+from mark_matrix import MarkMatrix
+
+
+def make_result(marks: dict[str, dict[str, float]]) -> collator.CollationResult:
+    matrix = MarkMatrix()
+    for question_id, question_marks in marks.items():
+        for author, mark in question_marks.items():
+            matrix.add_mark(question_id, author, mark)
+    return collator.CollationResult(None, {}, matrix)
+
+
+def make_statistics() -> moderation.CohortStatistics:
+    results = {
+        "ada": make_result({"1": {"Alice": 2.0, "Bob": 4.0, "Carol": 6.0}, "2": {"Alice": 3.0}}),
+        "curie": make_result({"1": {"Alice": 5.0, "Bob": 3.0}, "2": {"Alice": 1.0, "Bob": 2.0}, "3": {"Alice": 0.0, "Bob": 4.0}}),
+    }
+    return moderation.CohortStatistics(["ada", "curie"], results)
+
+
+def test_question_statistics():
+    statistics = make_statistics()
+    assert statistics.groups == [("ada", "1"), ("ada", "2"), ("curie", "1"), ("curie", "2"), ("curie", "3")]
+    assert statistics.counts.tolist() == [3, 1, 2, 2, 2]
+    assert statistics.means.tolist() == pytest.approx([4.0, 3.0, 4.0, 1.5, 2.0])
+    assert statistics.variances.tolist() == pytest.approx([8 / 3, 0.0, 1.0, 0.25, 4.0])
+    assert statistics.spreads.tolist() == pytest.approx([4.0, 0.0, 2.0, 1.0, 4.0])
+    assert statistics.max_deviations.tolist() == pytest.approx([2.0, 0.0, 1.0, 0.5, 2.0])
+    assert statistics.group_marks(0) == "Alice: 2; Bob: 4; Carol: 6"
+
+
+def test_needs_moderation_ranks_by_spread_then_variance():
+    statistics = make_statistics()
+    assert statistics.needs_moderation(1.5).tolist() == [4, 0, 2]
+    assert statistics.needs_moderation(4.0).tolist() == []
+
+
+def test_marker_bias():
+    statistics = make_statistics()
+    assert statistics.markers == ["Alice", "Bob", "Carol"]
+
+    # the question marked only by Alice is not compared
+    assert statistics.marker_counts.tolist() == [4, 4, 1]
+    assert statistics.marker_bias.tolist() == pytest.approx([-0.875, 0.375, 2.0])
+    assert statistics.marker_mean_deviation.tolist() == pytest.approx([1.375, 0.875, 2.0])
+    assert statistics.ranked_markers().tolist() == [2, 0, 1]
+
+
+def test_empty_cohort():
+    statistics = moderation.CohortStatistics([], {})
+    assert statistics.needs_moderation(0.0).tolist() == []
+    assert statistics.ranked_markers().tolist() == []